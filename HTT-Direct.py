@@ -5,7 +5,6 @@ Combines the HTT control system with the CL4790 radio implementation
 """
 
 import time
-import struct
 import threading
 import queue
 import json
@@ -18,6 +17,9 @@ import logging
 
 # Import the CL4790 radio controller
 from radio import CL4790Controller, CL4790Mode
+# Payload codecs shared with HTT.py, generated from protocol.json
+from protocol import CL4790
+from recorder import FlightRecorder, TX, RX
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -47,12 +49,15 @@ class ClientState(Enum):
     FORM_L = 3  # Formation Leader
     FORM_F = 4  # Formation Follower
 
-class PacketType(Enum):
-    CONTROLLER_INPUT = 1
-    OTHER_COMMAND = 2
-    RESPONSE_PACK_DIAG = 3
-    RESPONSE_PACK_STATUS = 4
-    RESPONSE_PACK_PATHNAME = 5
+PacketType = Enum('PacketType', CL4790.types)
+
+# Precompiled payload layouts
+RC_PACKET = CL4790.requests['rc']
+FORM_PACKET = CL4790.requests['form']
+RESPONSE_HEADER = CL4790.responses['header']
+DIAG_RESPONSE = CL4790.responses['diag']
+STATUS_RESPONSE = CL4790.responses['status']
+PATHNAME_RESPONSE = CL4790.responses['pathname']
 
 @dataclass
 class JoystickData:
@@ -143,11 +148,16 @@ class HTTRadioController:
     """Main HTT radio controller class using CL4790 radio"""
     
     def __init__(self, serial_port: str = 'COM9', baud_rate: int = 57600, 
-                 channel: int = 25, system_id: int = 123):
+                 channel: int = 25, system_id: int = 123,
+                 num_clients: int = NUM_CLIENTS, slot_time: float = 0.1,
+                 recorder: Optional[FlightRecorder] = None):
         self.serial_port = serial_port
         self.baud_rate = baud_rate
         self.channel = channel
         self.system_id = system_id
+        self.num_clients = num_clients
+        self.slot_time = slot_time  # Seconds per TDMA slot, one client per slot
+        self.recorder = recorder  # Optional FlightRecorder for every payload sent and received
         
         # Initialize CL4790 radio controller
         self.radio = CL4790Controller(serial_port, baud_rate)
@@ -167,7 +177,7 @@ class HTTRadioController:
         
         # Client data with MAC addresses
         self.clients = []
-        for i in range(NUM_CLIENTS):
+        for i in range(self.num_clients):
             client = ClientData(i+1)
             # Generate MAC addresses for each client (would be configured in real system)
             client.mac_address = f"12:34:56:78:9A:{i+1:02X}"
@@ -239,6 +249,8 @@ class HTTRadioController:
                 # Receive packet with timeout
                 packet_data = self.radio.receive_message(timeout=0.1)
                 if packet_data:
+                    if self.recorder is not None:
+                        self.recorder.record(RX, self.serial_port, packet_data, protocol='cl4790')
                     self._process_received_packet(packet_data)
             except Exception as e:
                 logger.error(f"Receive task error: {e}")
@@ -247,14 +259,14 @@ class HTTRadioController:
     def _process_received_packet(self, packet_data: bytes):
         """Process received packet from CL4790"""
         try:
-            if len(packet_data) < 4:
+            if len(packet_data) < RESPONSE_HEADER.size:
                 logger.warning("Received packet too short")
                 return
             
             # Parse response header (matching original HTT format)
-            client_id, packet_type, state, errors = struct.unpack('<BBBB', packet_data[:4])
+            client_id, packet_type, state, errors = RESPONSE_HEADER.unpack_from(packet_data)
             
-            if client_id == 0 or client_id > NUM_CLIENTS:
+            if client_id == 0 or client_id > self.num_clients:
                 logger.warning(f"Invalid client ID: {client_id}")
                 return
             
@@ -278,7 +290,7 @@ class HTTRadioController:
     
     def _radio_task(self):
         """Main radio task - handles packet transmission scheduling"""
-        schedule = [1, 2, 3, 4, 5, 6, 7, 8]  # Client scheduling
+        schedule = list(range(1, self.num_clients + 1))  # Client scheduling
         
         while self.running:
             try:
@@ -291,7 +303,7 @@ class HTTRadioController:
                         self._radio_loop_formation(self.cycle, schedule)
                         self.cycle += 1
                 
-                time.sleep(0.1)  # 100ms cycle time (adjusted for radio latency)
+                time.sleep(self.slot_time)  # 100ms cycle time (adjusted for radio latency)
                 
             except Exception as e:
                 logger.error(f"Radio task error: {e}")
@@ -314,24 +326,6 @@ class HTTRadioController:
     def _build_and_send_rc_packet(self, dest_client: int, resp_client: int, cycle: int):
         """Build and send RC control packet via CL4790"""
         try:
-            # Build RC payload (similar to original HTT format)
-            payload = bytearray()
-            
-            # Header (8 bytes)
-            payload.extend(struct.pack('<BBHHB', 
-                dest_client,        # activeClient
-                resp_client,        # respClient
-                cycle & 0xFFFF,     # cycle
-                PacketType.CONTROLLER_INPUT.value,  # ptype
-                self.clients[dest_client-1].state.value  # state
-            ))
-            
-            # Hit detection settings
-            payload.extend(struct.pack('<BB',
-                self.clients[dest_client-1].hit_threshold,
-                self.clients[dest_client-1].hit_time_limit
-            ))
-            
             # Joystick data
             if self.menu_mode:
                 joy_x = joy_y = joy_z = btns = 0
@@ -341,13 +335,26 @@ class HTTRadioController:
                 joy_z = self.joystick.z
                 btns = self.joystick.btn
             
-            payload.extend(struct.pack('<hhhB', joy_x, joy_y, joy_z, btns))
+            # Header, hit detection settings and joystick in one precompiled pack
+            dest = self.clients[dest_client-1]
+            payload = RC_PACKET.pack(
+                dest_client,        # activeClient
+                resp_client,        # respClient
+                cycle & 0xFFFF,     # cycle
+                PacketType.CONTROLLER_INPUT.value,  # ptype
+                dest.state.value,   # state
+                dest.hit_threshold,
+                dest.hit_time_limit,
+                joy_x, joy_y, joy_z, btns
+            )
             
             # Send packet to specific client using CL4790
-            client_mac = self.clients[dest_client-1].mac_address
-            success = self.radio.send_message(bytes(payload), client_mac)
+            success = self.radio.send_message(payload, dest.mac_address)
             
             if success:
+                if self.recorder is not None:
+                    self.recorder.record(TX, self.serial_port, payload, protocol='cl4790')
+
                 # Update client communication stats
                 client = self.clients[resp_client-1]
                 client.msg_sent += 1
@@ -371,24 +378,23 @@ class HTTRadioController:
         # Similar to RC packet but with formation-specific payload
         # Implementation would depend on formation control requirements
         try:
-            payload = bytearray()
-            
-            # Formation header
-            payload.extend(struct.pack('<BBHHBB', 
+            # Same header as the RC packet, then formation-specific data (placeholder)
+            payload = FORM_PACKET.pack(
                 dest_client,
                 resp_client,
                 cycle & 0xFFFF,
                 PacketType.OTHER_COMMAND.value,  # Formation command
-                self.clients[dest_client-1].state.value
-            ))
-            
-            # Formation-specific data (placeholder)
-            payload.extend(struct.pack('<ff', 0.0, 0.0))  # Formation offset x, y
+                self.clients[dest_client-1].state.value,
+                0.0, 0.0  # Formation offset x, y
+            )
             
             client_mac = self.clients[dest_client-1].mac_address
-            success = self.radio.send_message(bytes(payload), client_mac)
+            success = self.radio.send_message(payload, client_mac)
             
             if success:
+                if self.recorder is not None:
+                    self.recorder.record(TX, self.serial_port, payload, protocol='cl4790')
+
                 logger.debug(f"Sent formation packet to client {dest_client}")
                 
         except Exception as e:
@@ -397,21 +403,13 @@ class HTTRadioController:
     def _handle_diag_response(self, client: ClientData, payload: bytes):
         """Handle diagnostic response packet"""
         try:
-            if len(payload) < 20:  # Minimum expected size
+            if len(payload) < DIAG_RESPONSE.min_size:  # Minimum expected size
                 return
             
             # Parse diagnostic data (example - adjust based on actual format)
-            offset = 4  # Skip header
-            
-            # GPS data
-            if len(payload) >= offset + 8:
-                client.utm_x, client.utm_y = struct.unpack('<ii', payload[offset:offset+8])
-                offset += 8
-            
-            # Battery data
-            if len(payload) >= offset + 4:
-                client.bvolt[0], client.bvolt[1] = struct.unpack('<hh', payload[offset:offset+4])
-                offset += 4
+            data = DIAG_RESPONSE.decode(payload)
+            client.utm_x, client.utm_y = data['utm_x'], data['utm_y']
+            client.bvolt[0], client.bvolt[1] = data['bvolt']
                 
             logger.debug(f"Processed diagnostic data for client {client.id}")
             
@@ -421,20 +419,14 @@ class HTTRadioController:
     def _handle_status_response(self, client: ClientData, payload: bytes):
         """Handle status response packet"""
         try:
-            if len(payload) < 12:
+            if len(payload) < STATUS_RESPONSE.min_size:
                 return
             
-            offset = 4  # Skip header
-            
-            # Speed and course
-            if len(payload) >= offset + 4:
-                client.speed, client.cog = struct.unpack('<hh', payload[offset:offset+4])
-                offset += 4
-            
-            # GPS status
-            if len(payload) >= offset + 4:
-                client.num_sat1, client.gps_fix1, client.num_sat2, client.gps_fix2 = struct.unpack('<BBBB', payload[offset:offset+4])
-                offset += 4
+            # Speed and course, then GPS status
+            data = STATUS_RESPONSE.decode(payload)
+            client.speed, client.cog = data['speed'], data['cog']
+            client.num_sat1, client.gps_fix1 = data['num_sat1'], data['gps_fix1']
+            client.num_sat2, client.gps_fix2 = data['num_sat2'], data['gps_fix2']
                 
             logger.debug(f"Processed status data for client {client.id}")
             
@@ -444,11 +436,11 @@ class HTTRadioController:
     def _handle_pathname_response(self, client: ClientData, payload: bytes):
         """Handle pathname response packet"""
         try:
-            if len(payload) < 8:
+            if len(payload) < PATHNAME_RESPONSE.min_size:
                 return
             
             # Extract pathname data (example)
-            pathname = payload[4:].decode('utf-8', errors='ignore').strip('\x00')
+            pathname = PATHNAME_RESPONSE.decode(payload)['pathname'].decode('utf-8', errors='ignore').strip('\x00')
             logger.debug(f"Pathname from client {client.id}: {pathname}")
             
         except Exception as e:
@@ -463,18 +455,18 @@ class HTTRadioController:
     
     def set_client_state(self, client_id: int, state: ClientState):
         """Set client state"""
-        if 1 <= client_id <= NUM_CLIENTS:
+        if 1 <= client_id <= self.num_clients:
             self.clients[client_id - 1].state = state
     
     def get_client_data(self, client_id: int) -> Optional[ClientData]:
         """Get client data"""
-        if 1 <= client_id <= NUM_CLIENTS:
+        if 1 <= client_id <= self.num_clients:
             return self.clients[client_id - 1]
         return None
     
     def get_comm_performance(self, client_id: int) -> float:
         """Get communication performance percentage"""
-        if 1 <= client_id <= NUM_CLIENTS:
+        if 1 <= client_id <= self.num_clients:
             client = self.clients[client_id - 1]
             return sum(client.comm_perf) / COMM_PERF_SIZE * 100
         return 0.0
@@ -492,7 +484,7 @@ class HTTRadioController:
     
     def set_client_mac(self, client_id: int, mac_address: str):
         """Set MAC address for a client"""
-        if 1 <= client_id <= NUM_CLIENTS:
+        if 1 <= client_id <= self.num_clients:
             self.clients[client_id - 1].mac_address = mac_address
             logger.info(f"Set MAC address for client {client_id}: {mac_address}")
     
@@ -1,9 +1,19 @@
 import serial
 import serial.tools.list_ports
-from queue import Queue
+from collections import deque
+from functools import partial
+from queue import Empty, Queue
 import threading
 import time
-import struct
+from time import monotonic
+
+import numpy as np
+
+from hotplug import PortWatcher
+from metrics import REGISTRY
+from recorder import TX, RX
+from protocol import USB, ERRORS
+from uploads import UploadStore
 
 
 def num_to_letter(num):
@@ -29,30 +39,8 @@ class ThreadSafeCounter:
 
 
 
-TErrorCodeDict = {
-    #Motors
-    0x0001: "ERR_MOT1",
-    0x0002: "ERR_MOT2",
-    0x0004: "ERR_MOT3",
-    0x0008: "ERR_MOT4",
-
-    #Coms
-    0x0010: "ERR_RADIO_HW",
-    0x0020: "ERR_RADIO_PROTO",
-
-    #
-    0x0040: "ERR_FAN_TOP",
-    0x0080: "ERR_FAN_BOT",
-    0x0100: "ERR_NO_BATTERY",
-
-
-    0x0200: "ERR_NO_HITDET",
-    0x0400: "ERR_NO_RISER",
-    0x0800: "ERR_NO_GPS1",
-    0x1000: "ERR_NO_GPS2",
-    0x2000: "ERR_MOT_NOTRDY",
-    0x4000: "ERR_FAN_PDB",
-}
+#Robot error bits, defined in protocol.json
+TErrorCodeDict = ERRORS
 
 ErrorDiscriptor = {
     "ERR_MOT1": "No response from motor 1",
@@ -84,7 +72,18 @@ def usbPorts():
             usb_ports.append(port)
     return usb_ports
 
-def openPort(port=usbPorts()[0],baud=115200,timeout=0.5,writeout=0.5):
+class RadioUnavailable(serial.SerialException):
+    #No radio plugged in, or it went away, requests fail at once instead of waiting on a dead port
+    pass
+
+
+def openPort(port=None,baud=115200,timeout=0.5,writeout=0.5):
+    if port is None:
+        #Looked up when the port is opened, not at import, so the server starts without a radio
+        ports = usbPorts()
+        if not ports:
+            raise RadioUnavailable('No USB radio found')
+        port = ports[0]
     print(f'USB:{port}')
     port = serial.Serial(port=port,baudrate=baud,
                          timeout=timeout,write_timeout=writeout)
@@ -92,6 +91,8 @@ def openPort(port=usbPorts()[0],baud=115200,timeout=0.5,writeout=0.5):
 
 
 class Decoders:
+    #Response codecs generated from protocol.json
+    layouts = USB.responses
 
     def __init__(self):
         self.headers = {'request':0,
@@ -112,16 +113,50 @@ class Decoders:
 
     def decode(self,packet_type,packet):
         return self.headers[packet_type](packet)
+
+    def decode_many(self,packet_type,frames):
+        #Column arrays for a run of same-type frames, e.g. the gps responses of a recorded session
+        #frames is one buffer of back to back frames or a list of them, short or broken frames are skipped
+        layout = self.layouts[packet_type]
+        if not isinstance(frames,(bytes,bytearray,memoryview)):
+            frames = b''.join(frames)
+        raw = np.frombuffer(frames,dtype=np.uint8)
+        rows = raw[self.frame_offsets(raw,layout.size)[:,None] + np.arange(layout.size)]
+        records = rows.view(layout.dtype).ravel()
+        columns = {name:records[name].copy() for name in layout.names}
+        for name,convert in layout.columns.items():
+            columns[name] = convert(columns[name])
+        return columns
+
+    @staticmethod
+    def frame_offsets(raw,size):
+        #Start of every frame at least size bytes long, resynchronising on the 0x0D header
+        length = 4 + int(raw[1]) if len(raw) > 1 else 0
+        if length >= size and len(raw) % length == 0 and \
+           (raw[0::length] == 0x0D).all() and (raw[1::length] == length-4).all():
+            #Fixed length frames back to back, the usual case for one packet type
+            return np.arange(0,len(raw),length)
+        buf = raw.tobytes()
+        offsets = []
+        idx,end = 0,len(buf)
+        while idx < end - 1:
+            if buf[idx] != 0x0D:
+                idx = buf.find(b'\r',idx)
+                if idx < 0:
+                    break
+                continue
+            length = 4 + buf[idx+1]
+            if idx + length > end:
+                break
+            if length >= size:
+                offsets.append(idx)
+            idx += length
+        return np.array(offsets,dtype=np.intp)
     
     def upload_reponse(self,pack):
         # print('pack',pack)
         d = [element for element in pack]
-        data= {}
-        data['packet 0:'] = pack[0]
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        data['inventory_idx'] = pack[4]
-        data['next_packet'] = pack[5]
+        data = self.layouts['upload_scen'].decode(pack)
 
         
         print('RAW PACKET:',d)
@@ -129,75 +164,22 @@ class Decoders:
         return data
 
     def system(self,pack):
-        data = {}
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        data['clientId'] = pack[4]
-        data['state'] = pack[5]
-        data['errorbits'] = get_errors((pack[4+3] << 8) | (pack[4+2]&0xFF))
-        return data
+        return self.layouts['system'].decode(pack)
     
     def hit(self,pack):
-        data = {}
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        data['hitThreshold'] = pack[4]
-        data['hitTimeLimit'] = pack[5]
-        data['HdSensitivity'] = pack[6]
-        data['hitPauseTime'] = pack[7]
-        data['hit_zone_data'] = pack[8]
-        data['zonesEnable'] = bool(pack[9])
-        return data
+        return self.layouts['hit'].decode(pack)
     
     def gps(self,pack):
-        data = {}
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        raw_utmX = ((pack[4+3] << 24) | (pack[4+2] << 16) | (pack[4+1] << 8) | (pack[4+0] & 0xFF))
-        raw_utmY = ((pack[4+7] << 24) | (pack[4+6] << 16) | (pack[4+5] << 8) | (pack[4+4] & 0xFF))
-        data['utmX'] = raw_utmX / 10.
-        data['utmY'] = raw_utmY / 10.
-        data['utmZone'] = [pack[4+8],pack[4+9],pack[4+10],pack[4+11]]
-        data['numSat'] = pack[4+12]
-        data['gpsFix'] = pack[4+13]
-        data['COG'] = pack[4+14]
-        data['speed'] = pack[4+15]
-        return data
+        return self.layouts['gps'].decode(pack)
     
     def battery1(self,pack):
-        data = {}
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        data['bvolt'] = [((pack[4+1] << 8) | (pack[4+0] & 0xFF)),((pack[4+3] << 8) | (pack[4+2] & 0xFF))]
-        data['bcap'] = [pack[4+4],pack[4+5],pack[4+6]]
-        data['bcur'] = [((pack[4+8] << 8) | (pack[4+7] & 0xFF)),((pack[4+10] << 8) | (pack[4+9] & 0xFF)),((pack[4+12] << 8) | (pack[4+11] & 0xFF))]
-        return data
+        return self.layouts['bat1'].decode(pack)
     
     def paths(self,pack):
-        data = {}
-        payload = pack[4:]
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        data['cycle'] = payload[0]
-        data['Number of Paths'] = payload[1]
-
-        # data['Name:'] = [i for i in payload[:]]
-
-        return data
+        return self.layouts['get_scen_info'].decode(pack)
     
     def upload_request(self,pack):
-        data = {}
-        
-        payload = pack[4:]
-        
-        data['paylength'] = pack[1]
-        data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
-        data['Request Type'] = payload[0]
-        data['cycle'] = payload[1]
-
-        # data['Name:'] = [i for i in payload[1:]]
-
-        return data
+        return self.layouts['put_scen_info'].decode(pack)
     
     def debug(self,pack):
         data = {}
@@ -218,163 +200,741 @@ class Decoders:
 
 
 class PacketBuilder:
-    headers = {'usb':0xD,
-                'request':0,
-               'system':1,
-               'hit':2,
-               'gps':3,
-               'bat1':4,
-               'bat2':5,
-               'get_scen_info':6,
-               'put_scen_info':8,
-               'upload_scen':9,
-               'up':10,
-               'down':11,
-               'half':12,
-               'joy':13,
-               'On/Off':14,
-               'select_target':15,
-               }
-    paylen = 2
-    joy_paylen = 6
-    
+    headers = {'usb':USB.header,**USB.types}
+    #Precompiled layouts from protocol.json, every packet starts with the prefix (usb, paylen, serial lo, serial hi, type)
+    prefix = USB.requests['prefix'].struct
+    command = USB.requests['command'].struct
+    joy = USB.requests['joy'].struct
+    #A whole drive packet, prefix included, so a drive is one pack call
+    joy_packet = USB.requests['joy_packet'].struct
+    target = USB.requests['select_target'].struct
+    upload = USB.requests['upload_scen'].struct
+    #Scenario packets: prefix, total, last, index, then the data
+    scen_name = USB.requests['scen_name'].struct
+    scen_stamp = USB.requests['scen_stamp'].struct
+    scen_single = USB.requests['scen_single'].struct
+    scen_double = USB.requests['scen_double'].struct
+    scen_count = USB.requests['scen_count'].struct
+    scen_waypoint = USB.requests['scen_waypoint'].struct
+    #paylen counts the type byte and everything after it
+    paylen = 1 + command.size
+    joy_paylen = 1 + joy.size
+    target_paylen = 1 + target.size
+    upload_paylen = 1 + upload.size
+
+    def __init__(self):
+        #Header prefix per (serial, type), built once and reused for every packet
+        self.prefixes = {}
+        #Drive packer per serial with the prefix already bound
+        self.drives = {}
+        self.pack_command = self.command.pack
+        self.pack_target = self.target.pack
+        self.pack_upload = self.upload.pack
+
+    def _prefix(self,serial,data):
+        if data == 'joy':
+            paylen = self.joy_paylen
+        elif data == 'select_target':
+            paylen = self.target_paylen
+        elif data == 'upload_scen':
+            paylen = self.upload_paylen
+        else:
+            paylen = self.paylen
+        prefix = self.prefix.pack(self.headers['usb'],paylen,
+                                  (serial >> 0) & 0xF,(serial >> 4) & 0xF,
+                                  self.headers[data])
+        self.prefixes[serial,data] = prefix
+        return prefix
+
+    def _drive(self,serial):
+        drive = partial(self.joy_packet.pack,self.headers['usb'],self.joy_paylen,
+                        (serial >> 0) & 0xF,(serial >> 4) & 0xF,self.headers['joy'])
+        self.drives[serial] = drive
+        return drive
+
+    def drive(self,serial,cycle,jx,jy,jz=0,jb=0):
+        #get('joy') for the joystick path: positional, no keyword dispatch, one pack call once serial was seen
+        pack = self.drives.get(serial) or self._drive(serial)
+        return pack(cycle,jx + 100,jy + 100,jz + 100,jb)
+
     def get(self,data='request',cycle=1,serial=1201,jx=0,jy=0,jz=0,jb=0,waypoints=[],target=1):
-        if data!= 'upload_scen':
-            paylen = self.paylen if data!='joy' else self.joy_paylen
-            # paylen = self.paylen + 1 if data=='select_target' else 0
-            packet_ = bytearray(4+paylen)
-            packet_[0] = self.headers['usb']
-            packet_[1] = paylen
-            packet_[2] = ((serial >> 0) & 0xF)
-            packet_[3] = ((serial>> 4) & 0xF)
-            packet_[4] = self.headers[data]
-            packet_[5] = cycle
-            if data == 'joy':
-                packet_[6] = (jx + 100)
-                packet_[7] = (jy + 100) 
-                packet_[8] = (jz + 100)
-                packet_[9] = jb
-            elif data == 'select_target':
-                packet_[6] = target
+        if data == 'joy':
+            return (self.drives.get(serial) or self._drive(serial))(cycle,jx + 100,jy + 100,jz + 100,jb)
+        prefix = self.prefixes.get((serial,data)) or self._prefix(serial,data)
+        if data == 'select_target':
+            return prefix + self.pack_target(cycle,target)
+        elif data != 'upload_scen':
+            return prefix + self.pack_command(cycle)
         else:
             #(type) (totat # of packets, current packet, ) (9 data point long payload)
-            paylen = 1+2+9
-            packet_ = bytearray(4+paylen)
-            packet_[0] = self.headers['usb']
-            packet_[1] = paylen
-            packet_[2] = ((serial >> 0) & 0xF)
-            packet_[3] = ((serial>> 4) & 0xF)
-            packet_[4] = self.headers[data]
-            packet_[5] = len(waypoints)
-
-        return packet_
-    
-    def waypointer(self, name, date, time, origin, waypoints):
-        serial = 1204
+            return prefix + self.pack_upload(len(waypoints))
+    
+    def waypointer(self, name, date, time, origin, waypoints, serial=1204):
         packets = []
+        # paylen counts type, total and index on top of the data, as the robot expects
+        head = (self.headers['usb'], 0, (serial >> 0) & 0xF, (serial >> 4) & 0xF,
+                self.headers['upload_scen'], len(waypoints) + 9, len(waypoints) + 8)
+
+        def base_packet(idx, layout, *values):
+            return layout.pack(head[0], layout.size - 5, *head[2:], idx, *values)
 
         # === Build packets 0–8 as before ===
         padded_name = name.encode("utf-8").ljust(12, b'\x00')
-
-        def base_packet(idx, data_bytes):
-            paylen = 1 + 2 + len(data_bytes)
-            p = bytearray(4 + paylen)
-            p[0] = self.headers['usb']
-            p[1] = paylen
-            p[2] = ((serial >> 0) & 0xF)
-            p[3] = ((serial >> 4) & 0xF)
-            p[4] = self.headers['upload_scen']
-            p[5] = len(waypoints) + 9
-            p[6] = len(waypoints) + 8
-            p[7] = idx
-            p[8:] = data_bytes
-            return p
-
-        packets.append(base_packet(0, padded_name[:6]))
-        packets.append(base_packet(1, padded_name[6:12]))
-        packets.append(base_packet(2, struct.pack('<I', date) + struct.pack('<I', time)))
-        packets.append(base_packet(3, struct.pack('<f', origin[0])))
-        packets.append(base_packet(4, b'\x00' * 8))
-        packets.append(base_packet(5, struct.pack('<f', origin[1])))
-        packets.append(base_packet(6, b'\x00' * 8))
-        packets.append(base_packet(7, struct.pack('<f', origin[2]) + struct.pack('<f', origin[3])))
-        packets.append(base_packet(8, struct.pack('<H', len(waypoints)) + struct.pack('<H', 0)))
+        packets.append(base_packet(0, self.scen_name, padded_name[:6]))
+        packets.append(base_packet(1, self.scen_name, padded_name[6:12]))
+        packets.append(base_packet(2, self.scen_stamp, date, time))
+        packets.append(base_packet(3, self.scen_single, origin[0]))
+        packets.append(base_packet(4, self.scen_double, 0, 0))
+        packets.append(base_packet(5, self.scen_single, origin[1]))
+        packets.append(base_packet(6, self.scen_double, 0, 0))
+        packets.append(base_packet(7, self.scen_double, origin[2], origin[3]))
+        packets.append(base_packet(8, self.scen_count, len(waypoints), 0))
 
         # === Waypoint packets: each 12 bytes (x, y, flag) ===
+        pack = self.scen_waypoint.pack
+        paylen = self.scen_waypoint.size - 5
         for i, (x, y, flag) in enumerate(waypoints):
-            payload = struct.pack('<f', x) + struct.pack('<f', y) + struct.pack('<f', flag)
-            packets.append(base_packet(9 + i, payload))
+            packets.append(pack(head[0], paylen, head[2], head[3], head[4], head[5], head[6], 9 + i, x, y, flag))
 
         return packets
 
 
     
-class RadioStack:
-    def __init__(self,**kwargs):
-        self.messages = {}
-        self.port = openPort(**kwargs)
+class FrameReader:
+    #Slices HTT frames (0x0D, length, serial lo, serial hi, payload) out of the raw byte stream
+    header = 0x0D
+    overhead = 4
+
+    def __init__(self,port,size=4096):
+        self.port = port
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def _frame(self):
+        buf = self.buffer
+        while self.end - self.start >= 2:
+            if buf[self.start] != self.header:
+                #Resync on the next header byte, dropping line endings and noise
+                idx = buf.find(b'\r',self.start,self.end)
+                self.start = idx if idx >= 0 else self.end
+                continue
+            length = self.overhead + buf[self.start+1]
+            if self.end - self.start < length:
+                return None
+            frame = bytes(self.view[self.start:self.start+length])
+            self.start += length
+            return frame
+        return None
+
+    def _fill(self):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            #Move the partial frame back to the front of the buffer
+            pending = self.end - self.start
+            self.buffer[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        want = max(1,min(self.port.in_waiting,len(self.buffer)-self.end))
+        n = self.port.readinto(self.view[self.end:self.end+want]) or 0
+        self.end += n
+        return n
+
+    def read_frame(self):
+        while True:
+            frame = self._frame()
+            if frame is not None:
+                return frame
+            if not self._fill():
+                #A frame never spans a silent timeout, so give up on the partial one
+                if self.start < self.end:
+                    self.start += 1
+                return b''
+
+    def reset(self):
+        self.start = self.end = 0
+
+
+class RadioTimeout(Exception):
+    pass
+
+
+def serial_key(serial):
+    #Bytes 2 and 3 as PacketBuilder writes them for this serial
+    return ((serial >> 0) & 0xF, (serial >> 4) & 0xF)
+
+
+def response_key(response):
+    #Responses carry the full little-endian serial in bytes 2 and 3
+    if not response or len(response) < 4:
+        return None
+    return serial_key((response[3] << 8) | (response[2] & 0xFF))
+
+
+#Scheduling classes for the radio, lower goes out first
+PRIORITY = {'stop':0,
+            'drive':1,
+            'command':2,
+            'telemetry':3,
+            'upload':4,
+            }
+
+
+#Packet type names for metric labels, raw reads have no packet
+PACKET_NAMES = {value:name for name,value in USB.types.items()}
+
+
+def packet_name(packet):
+    if packet is None:
+        return 'read'
+    return PACKET_NAMES.get(packet[4],str(packet[4]))
+
+
+def response_layout(kind):
+    #Layout of the answer to a request type, commands and drives are answered with the robot's status
+    return kind if kind in USB.responses else 'system'
+
+
+class ResponseMatcher:
+    #Pairs recorded answers with the request type they answer, the way RadioStack matches them live
+    def __init__(self,waiting=None):
+        #Serial key -> type of the request waiting on that robot
+        self.waiting = dict(waiting or {})
+
+    def sent(self,packet):
+        if len(packet) > 4:
+            self.waiting[(packet[2],packet[3])] = PACKET_NAMES.get(packet[4],'request')
+
+    def answered(self,response):
+        #Response layout name for response, None when no request was waiting for it
+        kind = self.waiting.pop(response_key(response),None)
+        if kind is None:
+            #Upload acks from the dongle carry serial 0, they belong to the upload in flight
+            key = next((k for k,v in self.waiting.items() if v == 'upload_scen'),None)
+            kind = self.waiting.pop(key,None)
+        if kind is None:
+            return None
+        return response_layout(kind)
+
+
+def summarize_waits(waits):
+    waits = sorted(waits)
+    if not waits:
+        return {'count':0}
+    return {'count':len(waits),
+            'mean':1000*sum(waits)/len(waits),
+            'p50':1000*waits[len(waits)//2],
+            'max':1000*waits[-1],
+            }
+
+
+class PendingRequest:
+    #Completion handle for one packet handed to the radio I/O thread
+    def __init__(self,id_,packet,sleep=0,lane='command',patience=None):
+        self.id = id_
+        self.packet = packet
+        self.sleep = sleep
+        self.lane = lane
+        #Seconds to wait for the answer once written, None means the port timeout
+        self.patience = patience
+        self.priority = (PRIORITY[lane],id_)
+        self.key = (packet[2],packet[3]) if packet is not None else None
+        self.kind = packet_name(packet)
+        #Frame length of the expected answer, None for raw reads which take anything
+        self.answer_size = None if packet is None else USB.responses[response_layout(self.kind)].size
+        self.taken = False
+        self.queued_at = time.monotonic()
+        self.written_at = None
+        self.deadline = None
+        self.response = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def __lt__(self,other):
+        return self.priority < other.priority
+
+    def add_done_callback(self,fn):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(fn)
+                return
+        fn(self)
 
-        #Since application is threaded make sure the interactions at the port are thread safe
-        self.queue = Queue()
+    def resolve(self,response):
+        with self.lock:
+            first = not self.done.is_set()
+            self.response = response
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        if first:
+            for fn in callbacks:
+                fn(self)
+
+    def cancel(self):
+        #Cancelled requests are answered with 'N/A' like the old clear path
+        self.cancelled = True
+        self.resolve('N/A')
+
+    def fail(self,error):
+        #The radio went away, result() raises error and callbacks see response None
+        self.error = error
+        self.resolve(None)
+
+    def result(self,timeout=None):
+        if not self.done.wait(timeout):
+            self.cancel()
+            raise RadioTimeout(f'No response to request {self.id} after {timeout}s')
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class RadioStack:
+    def __init__(self,port=None,request_timeout=5.0,window=1,watcher=None,backoff=(0.5,10.0),metrics=REGISTRY,recorder=None,**kwargs):
+        #The port opens in the background, port=None takes the first USB radio found at that time
+        self.portname = port
+        self.port_kwargs = kwargs
+        self.port_timeout = kwargs.get('timeout',0.5)
+        self.port = None
+        self.framer = None
+        self.online = threading.Event()
+        #Reconnect delay doubles from backoff[0] up to backoff[1], a hot-plug event retries at once
+        self.backoff = backoff
+        self.wake = threading.Event()
+        self.reconnects = 0
+        self.request_timeout = request_timeout
+
+        #window=1 is stop-and-wait, larger windows keep that many robots in flight at once
+        self.window = window
+        self.in_flight = []
+
+        #Only the I/O threads touch the port, everyone else queues a PendingRequest.
+        #Requests leave the queue by PRIORITY lane, then arrival
+        self.queue = []
+        self.cond = threading.Condition()
         self.count = ThreadSafeCounter()
-        self.lock  = threading.Lock()
-    
-    def write(self,packet):
+
+        #Latest-wins drive slot per robot, a newer vector replaces one that has not gone out yet
+        self.mailbox = {}
+        self.coalesced = 0
+
+        #Time from submit to write per lane, in seconds
+        self.lane_wait = {lane:deque(maxlen=500) for lane in PRIORITY}
+        #Histograms per packet type for queue wait, serial write and response wait, plus timeouts and drops
+        self.metrics = metrics
+        #FlightRecorder that keeps every frame sent and received, None records nothing
+        self.recorder = recorder
+        self.counters = {'tx':0,'rx':0,'tx_bytes':0,'rx_bytes':0,'timeouts':0}
+        self.started = time.monotonic()
+
+        self.running = True
+        self.link_thread = threading.Thread(target=self._link_task,daemon=True)
+        self.io_thread = threading.Thread(target=self._io_task,daemon=True)
+        self.rx_thread = threading.Thread(target=self._rx_task,daemon=True)
+        self.link_thread.start()
+        self.io_thread.start()
+        self.rx_thread.start()
+        if watcher is not None:
+            watcher.subscribe(self._ports_changed)
+
+    @property
+    def connected(self):
+        return self.online.is_set()
+
+    @property
+    def name(self):
+        if self.port is not None:
+            return self.port.port
+        return self.portname or 'USB radio'
+
+    def _connect(self):
+        port = openPort(self.portname,**self.port_kwargs)
+        with self.cond:
+            self.port = port
+            self.framer = FrameReader(port)
+            self.online.set()
+            self.cond.notify_all()
+
+    def _link_task(self):
+        delay = self.backoff[0]
+        while self.running:
+            if self.online.is_set():
+                self.wake.wait(1.0)
+                self.wake.clear()
+                continue
+            try:
+                self._connect()
+                if self.reconnects:
+                    print(f'Radio {self.name} reconnected')
+                self.reconnects += 1
+                delay = self.backoff[0]
+            except (serial.SerialException,OSError) as e:
+                print(f'Radio unavailable, retrying in {delay:.1f}s: {e}')
+                self.wake.wait(delay)
+                self.wake.clear()
+                delay = min(self.backoff[1],delay*2)
+
+    def _ports_changed(self,added,removed):
+        if self.port is not None and self.port.port in removed:
+            self._drop(RadioUnavailable(f'Radio {self.port.port} was unplugged'))
+        elif added and not self.online.is_set():
+            self.wake.set()
+
+    def _drop(self,error):
+        #Close the dead port and fail everything waiting on it, the link thread reconnects
+        with self.cond:
+            if self.port is None:
+                return
+            port,self.port = self.port,None
+            self.online.clear()
+            waiting = self.in_flight + self.queue
+            self.in_flight,self.queue = [],[]
+            self.cond.notify_all()
+        print(f'Radio {port.port} lost: {error}')
+        try:
+            port.close()
+        except Exception:
+            pass
+        for pending in waiting:
+            self.metrics.inc('radio_failed_total',packet=pending.kind)
+            pending.fail(error if isinstance(error,RadioUnavailable) else RadioUnavailable(str(error)))
+        self.wake.set()
+
+    def _write(self,packet):
         self.port.write(packet)
-    
+        self.counters['tx'] += 1
+        self.counters['tx_bytes'] += len(packet)
+        if self.recorder is not None:
+            self.recorder.record(TX,self.port.port,packet)
+
+    def _read(self):
+        frame = self.framer.read_frame()
+        if frame:
+            self.counters['rx'] += 1
+            self.counters['rx_bytes'] += len(frame)
+            if self.recorder is not None:
+                self.recorder.record(RX,self.port.port,frame)
+        return frame
+
+    def _can_send(self,pending):
+        if not self.in_flight or pending.lane == 'stop':
+            #Stops never wait on the window, the robot still answers its requests in order
+            return True
+        #Raw reads and slow (sleep) requests go out alone, robots get one request in flight each
+        if pending.packet is None or pending.sleep or self.in_flight[0].packet is None:
+            return False
+        if pending.lane == 'upload':
+            #Upload packets stream back to back, Requests.uploader bounds them and matches acks by index
+            return all(p.lane == 'upload' for p in self.in_flight if p.key == pending.key)
+        if len(self.in_flight) >= self.window:
+            return False
+        return all(p.key != pending.key for p in self.in_flight)
+
+    def _next(self):
+        #Highest priority request that may go out now, a blocked robot does not hold up the others
+        self.queue = [p for p in self.queue if not p.cancelled]
+        ready = [p for p in self.queue if self._can_send(p)]
+        if not ready:
+            return None
+        pending = min(ready)
+        self.queue.remove(pending)
+        return pending
+
+    def _io_task(self):
+        while self.running:
+            with self.cond:
+                pending = self._next() if self.port is not None else None
+                if pending is None:
+                    self.cond.wait(0.1)
+                    continue
+                #Freezes pending.packet, later posts open a new mailbox slot
+                pending.taken = True
+                patience = (self.port_timeout or 0) if pending.patience is None else pending.patience
+                pending.deadline = time.monotonic() + pending.sleep + patience
+                self.in_flight.append(pending)
+                self.cond.notify_all()
+            try:
+                start = time.monotonic()
+                if pending.packet is not None:
+                    self._write(pending.packet)
+                pending.written_at = time.monotonic()
+                wait = start - pending.queued_at
+                self.lane_wait[pending.lane].append(wait)
+                self.metrics.observe('radio_seconds',wait,stage='queue',packet=pending.kind)
+                self.metrics.observe('radio_seconds',pending.written_at - start,stage='write',packet=pending.kind)
+            except (serial.SerialException,OSError,AttributeError) as e:
+                #AttributeError is pyserial's way of saying the port closed under us
+                self._drop(e)
+            except Exception as e:
+                print(f'Radio I/O error: {e}')
+                self._complete(pending,None)
+
+    def _rx_task(self):
+        while self.running:
+            with self.cond:
+                idle = not self.in_flight or self.port is None
+                if idle:
+                    self.cond.wait(0.1)
+            if idle:
+                continue
+            try:
+                response = self._read()
+            except (serial.SerialException,OSError,AttributeError,TypeError) as e:
+                self._drop(e)
+                continue
+            except Exception as e:
+                print(f'Radio I/O error: {e}')
+                response = b''
+            if response:
+                self._match(response)
+            self._expire()
+
+    def _match(self,response):
+        key = response_key(response)
+        length = 4 + response[1] if len(response) > 1 else len(response)
+        with self.cond:
+            #Only requests whose answer has this length, a late answer to an expired request is not another's
+            fits = [p for p in self.in_flight if p.answer_size is None or p.answer_size == length]
+            #Unknown serials (e.g. 0 from the dongle's upload acks) belong to the oldest request
+            fallback = next((p for p in fits if p.lane == 'upload'),fits[0] if fits else None)
+            pending = next((p for p in fits if p.key == key),fallback)
+        if pending is None:
+            self.metrics.inc('radio_stray_total')
+            return
+        self._complete(pending,response)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self.cond:
+            expired = [p for p in self.in_flight if p.deadline <= now]
+        for pending in expired:
+            #Same answer readline() gave when the port timed out
+            self.counters['timeouts'] += 1
+            self.metrics.inc('radio_timeouts_total',packet=pending.kind)
+            self._complete(pending,b'')
+
+    def _complete(self,pending,response):
+        with self.cond:
+            if pending in self.in_flight:
+                self.in_flight.remove(pending)
+            self.cond.notify_all()
+        if response and pending.written_at is not None:
+            self.metrics.observe('radio_seconds',time.monotonic() - pending.written_at,stage='response',packet=pending.kind)
+        if not pending.cancelled:
+            pending.resolve(response)
+
+    def clear(self,key,stop=False):
+        #Queued drives and commands for robot key are stale once a stop or command for it goes out, other robots
+        #keep theirs. Queued stops always go out, a new stop (stop=True) only replaces an older one for the same robot
+        with self.cond:
+            for queued in self.queue:
+                if queued.key != key:
+                    continue
+                if queued.lane == 'stop':
+                    if stop:
+                        queued.cancel()
+                elif queued.priority[0] <= PRIORITY['command']:
+                    queued.cancel()
+
+    def submit(self,packet,sleep=0,clear=False,lane='command',patience=None):
+        if not self.online.is_set():
+            raise RadioUnavailable(f'{self.name} is not connected')
+        pending = PendingRequest(self.count.increment(),packet,sleep,lane,patience)
+        with self.cond:
+            if clear:
+                self.clear(pending.key,lane == 'stop')
+            self.queue.append(pending)
+            self.cond.notify_all()
+        return pending
+
+    def post(self,packet):
+        if not self.online.is_set():
+            raise RadioUnavailable(f'{self.name} is not connected')
+        key = (packet[2],packet[3])
+        with self.cond:
+            slot = self.mailbox.get(key)
+            if slot is not None and not slot.taken and not slot.done.is_set():
+                slot.packet = packet
+                self.coalesced += 1
+                self.metrics.inc('joystick_dropped_total',reason='coalesced')
+                return slot
+            slot = PendingRequest(self.count.increment(),packet,lane='drive')
+            self.mailbox[key] = slot
+            self.queue.append(slot)
+            self.cond.notify_all()
+        return slot
+
+    def request(self,packet,sleep=0,clear=False,timeout=None,lane='command'):
+        pending = self.submit(packet,sleep,clear,lane)
+        return pending.result(self.request_timeout if timeout is None else timeout)
+
     def read(self):
-        return self.port.readline()
-    
-    def _send(self,packet):
-        id_ = self.count.increment()
-        self.queue.put((id_,packet))
-        return id_
-    
-    def request(self,packet,sleep=0,clear=False):
-        id_ = self._send(packet)
-        self.send(sleeper=sleep,clear=clear)
-        while True:
-            with self.lock:
-                if id_ in self.messages:
-                    return self.messages.pop(id_)             
-
-    def send(self,sleeper=0,clear=False):
-        if clear:
-            if not self.queue.empty():
-                while not self.queue.empty():
-                    id_,packet = self.queue.get()
-                    if not self.queue.empty():
-                        self.messages[id_] = 'N/A'
-
-                with self.lock:
-                    # self.queue.clear()
-                    self.write(packet)
-                    message = self.read()
-                
-                    self.messages[id_] = message
-                    
+        return self.request(None)
+
+    def latency(self,lane='stop'):
+        #Queue wait in ms for the last few hundred packets of a lane
+        return summarize_waits(self.lane_wait[lane])
+
+    def stats(self):
+        uptime = time.monotonic() - self.started
+        stats = dict(self.counters)
+        stats['tx_rate'] = stats['tx']/uptime
+        stats['rx_rate'] = stats['rx']/uptime
+        stats['queued'] = len(self.queue)
+        stats['in_flight'] = len(self.in_flight)
+        stats['connected'] = self.connected
+        stats['reconnects'] = max(0,self.reconnects-1)
+        return {self.name:stats}
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.link_thread.join()
+        self.io_thread.join()
+        self.rx_thread.join()
+        if self.port is not None:
+            self.port.close()
+
+
+class RadioPool:
+    #One RadioStack (and its I/O threads) per USB radio, robots are pinned to a radio by serial.
+    #ports='all' follows the watcher: the pool may start empty and radios join and leave as they are plugged in and out
+    def __init__(self,ports=None,watcher=None,**kwargs):
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.dynamic = ports in (None,'all')
+        if not self.dynamic:
+            ports = list(ports)
+            if not ports:
+                raise RadioUnavailable('No USB radios given')
+            self.stacks = [RadioStack(port=port,watcher=watcher,**kwargs) for port in ports]
+            return
+        self.stacks = []
+        if watcher is None:
+            self._ports_changed(set(usbPorts()),set())
+            return
+        watcher.subscribe(self._ports_changed)
+        self._ports_changed(set(watcher.ports),set())
+
+    def _ports_changed(self,added,removed):
+        #The pool owns its stacks here, they are not subscribed to the watcher themselves
+        with self.lock:
+            known = {stack.portname for stack in self.stacks}
+            gone = [stack for stack in self.stacks if stack.portname in removed]
+            self.stacks = [stack for stack in self.stacks if stack.portname not in removed]
+            self.stacks += [RadioStack(port=port,**self.kwargs) for port in sorted(added - known)]
+            #Robots on a removed radio, and every unpinned robot, are spread again over what is left
+            self.routes = {key:stack for key,stack in self.routes.items() if stack not in gone}
+        for stack in gone:
+            stack._drop(RadioUnavailable(f'Radio {stack.portname} was unplugged'))
+            stack.close()
+
+    def assign(self,serial,port):
+        #Pin a robot to a radio, port is a device name or an index into self.stacks
+        with self.lock:
+            if not isinstance(port,int):
+                port = [stack.name for stack in self.stacks].index(port)
+            self.routes[serial_key(serial)] = self.stacks[port]
 
+    def stack_for(self,packet):
+        with self.lock:
+            if not self.stacks:
+                raise RadioUnavailable('No USB radios connected')
+            if packet is None:
+                return self.stacks[0]
+            key = (packet[2],packet[3])
+            if key not in self.routes:
+                #Spread unassigned robots over the radios by their serial's low byte
+                self.routes[key] = self.stacks[(key[0] + (key[1] << 4)) % len(self.stacks)]
+            return self.routes[key]
+
+    def submit(self,packet,sleep=0,clear=False,lane='command',patience=None):
+        #Only the radio that owns the robot holds its queued drives, it clears them itself
+        return self.stack_for(packet).submit(packet,sleep,clear,lane,patience)
+
+    def post(self,packet):
+        return self.stack_for(packet).post(packet)
+
+    def request(self,packet,sleep=0,clear=False,timeout=None,lane='command'):
+        stack = self.stack_for(packet)
+        pending = self.submit(packet,sleep,clear,lane)
+        return pending.result(stack.request_timeout if timeout is None else timeout)
+
+    def read(self):
+        return self.stack_for(None).read()
+
+    @property
+    def port_timeout(self):
+        return self.kwargs.get('timeout',0.5)
+
+    @property
+    def coalesced(self):
+        return sum(stack.coalesced for stack in self.stacks)
+
+    @property
+    def connected(self):
+        return any(stack.connected for stack in self.stacks)
+
+    def latency(self,lane='stop'):
+        return summarize_waits([w for stack in self.stacks for w in stack.lane_wait[lane]])
+
+    def stats(self):
+        stats = {}
+        for stack in self.stacks:
+            stats.update(stack.stats())
+        return stats
+
+    def close(self):
+        with self.lock:
+            stacks,self.stacks = self.stacks,[]
+        for stack in stacks:
+            stack.close()
+
+
+class RttEstimator:
+    #Jacobson/Karels smoothed round trip, gives the retransmit timeout for uploads
+    def __init__(self,rto=1.0,lower=0.05,upper=3.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = rto
+        self.lower = lower
+        self.upper = upper
+
+    def sample(self,rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt/2
         else:
-            while True:
-                if not self.queue.empty():
-                    id_,packet = self.queue.get()
-                    
-                    with self.lock:
-                        
-                        self.write(packet)
-                        time.sleep(sleeper)
-                        message = self.read()
-                    
-                        self.messages[id_] = message
-                    return 0
-                else:
-                    return 0
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt-rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+        self.rto = min(self.upper,max(self.lower,self.srtt + 4*self.rttvar))
+
+    def backoff(self):
+        self.rto = min(self.upper,self.rto*2)
 
 
 class Requests:
-    def __init__(self,**kwargs):
-        #USB/Serial interface with radio
-        self.radio = RadioStack(**kwargs)
+    def __init__(self,ports=None,upload_dir='uploads',metrics=REGISTRY,recorder=None,**kwargs):
+        #Notices radios being plugged in and out, the stacks reconnect from it
+        self.watcher = PortWatcher(usbPorts).start()
+
+        #Latency histograms and counters, exported by the Flask app on /metrics
+        self.metrics = metrics
+        self.recorder = recorder
+
+        #USB/Serial interface with radio, a list of ports (or 'all') shards robots over several radios
+        if ports is None:
+            self.radio = RadioStack(watcher=self.watcher,metrics=metrics,recorder=recorder,**kwargs)
+        else:
+            self.radio = RadioPool(ports,watcher=self.watcher,metrics=metrics,recorder=recorder,**kwargs)
+
+        #Ack state of scenario uploads, kept on disk so a dropped link resumes where it stopped
+        self.uploads = UploadStore(upload_dir)
 
         #Builds the packes to make data requests and commands
         self.pb = PacketBuilder()
@@ -384,64 +944,156 @@ class Requests:
     
     def request(self,packet_type='system',**kwargs):
         packet = self.pb.get(packet_type,**kwargs)
-        response = self.radio.request(packet)
-        return self.decoder.decode(packet_type,response)
+        response = self.radio.request(packet,lane='telemetry')
+        return self._decoded(packet_type,response,kwargs.get('serial'))
+
+    def request_async(self,callback,packet_type='system',**kwargs):
+        #request() without waiting: callback(decoded, error) runs on the radio thread once the answer is in,
+        #so several robots can be asked at once on a pipelined radio. Submitting may raise RadioUnavailable
+        packet = self.pb.get(packet_type,**kwargs)
+        def done(pending):
+            if pending.error is not None:
+                callback(None,pending.error)
+                return
+            try:
+                decoded = self._decoded(packet_type,pending.response,kwargs.get('serial'))
+            except Exception as e:
+                callback(None,e)
+                return
+            callback(decoded,None)
+        return self.radio.submit(packet,lane='telemetry').add_done_callback(done)
+
+    def _decoded(self,packet_type,response,serial):
+        if not response:
+            #The port timeout passed without an answer
+            raise RadioTimeout(f'No {packet_type} answer from robot {serial}')
+        start = monotonic()
+        decoded = self.decoder.decode(packet_type,response)
+        self.metrics.observe('radio_seconds',monotonic() - start,stage='decode',packet=packet_type)
+        return decoded
     
     def command(self,packet_type='up',**kwargs):
         packet = self.pb.get(packet_type,**kwargs)
-        response = self.radio.request(packet)
+        response = self.radio.request(packet,lane='command')
         return response
     
-    def supercommand(self,packet_type='up',**kwargs):
+    def drive(self,packet_type='joy',**kwargs):
+        #Fire and forget, the radio sends whatever vector is newest when this robot's slot comes up
         packet = self.pb.get(packet_type,**kwargs)
-        response = self.radio.request(packet,clear=True)
+        return self.radio.post(packet)
+    
+    def supercommand(self,packet_type='up',lane='stop',**kwargs):
+        packet = self.pb.get(packet_type,**kwargs)
+        response = self.radio.request(packet,clear=True,lane=lane)
         return response
     
-    def uploader(self,name,date, time, origin,waypoint):
-        packets = self.pb.waypointer(name,date, time, origin,waypoint)
-        n = 0
-        double = 0
-        retries = 0
-        while n < len(packets) and retries<20:
-            response = self.radio.request(packets[n],0.5)
-            
+    def uploader(self,name,date, time, origin,waypoint,serial=1204,window=4,retries=20):
+        #Keeps up to window packets on the air and resends only what the robot has not acknowledged
+        packets = self.pb.waypointer(name,date, time, origin,waypoint,serial)
+        total = len(packets)
+        session = self.uploads.open(serial,packets)
+        acked = set(session.acked)
+        missing = session.missing()
+        if acked:
+            print(f'Resuming upload at packet {missing[0] if missing else total}/{total}')
+        flight = {}
+        resent = set()
+        #When the robot said it stored each index during this upload, saved acks from an earlier attempt count as never
+        acked_at = {}
+        rtt = RttEstimator()
+        acks = Queue()
+        failures = 0
+        while len(acked) < total and failures < retries:
+            while len(flight) < window and missing:
+                idx = missing.pop(0)
+                if idx in acked:
+                    continue
+                pending = self.radio.submit(packets[idx],lane='upload',patience=rtt.rto)
+                flight[idx] = monotonic()
+                pending.add_done_callback(lambda p,idx=idx: acks.put((idx,p.response)))
+            if not flight:
+                break
+
+            try:
+                #Every answer, even a timeout, arrives within the largest RTO plus the port timeout
+                idx,response = acks.get(timeout=rtt.upper + self.radio.port_timeout)
+            except Empty:
+                #Nothing came back at all, give up on what is on the air and queue it again
+                failures += 1
+                rtt.backoff()
+                for idx in flight:
+                    resent.add(idx)
+                    if idx not in acked and idx not in missing:
+                        missing.append(idx)
+                        self.metrics.inc('radio_retries_total',packet='upload_scen')
+                flight.clear()
+                missing.sort()
+                continue
+            if idx not in flight:
+                #Answer to a send given up on above, the packet is queued again
+                continue
+            sent_at = flight.pop(idx)
             try:
                 decoded_msg = self.decoder.decode('upload_scen',response)
-                serial_ = int(decoded_msg.get('serial',1))
-                if serial_ != 0 and n<10:
-                    if serial ==2:
-                        n+=1
-                        print(f'Packet {n}/{len(packets)-1} accepted')
-                        break
-                    retries+=1
-                    self.radio.read()
-                    self.radio.read()
-                    
-                elif double == 0:
-                    retries = 0
-                    n+=1
-                    print(f'Packet {n}/{len(packets)-1} accepted')
-                
-                if n>=10:
-                    double+=1
-                    double = double%2
-
-            except Exception as e:
-                if n == len(packets)-1:
-                    break
-                retries+=1
-           
-        if retries ==0:
-            return True
-        else:
-            return False
+                stored = decoded_msg['inventory_idx']
+                wanted = decoded_msg['next_packet']
+            except Exception:
+                #No usable ack before the RTO, back off and queue the packet again
+                failures += 1
+                rtt.backoff()
+                resent.add(idx)
+                if idx not in acked and idx not in missing:
+                    missing.append(idx)
+                    self.metrics.inc('radio_retries_total',packet='upload_scen')
+                missing.sort()
+                continue
+
+            if stored == idx and idx not in resent:
+                #Karn: only first transmissions give a clean RTT sample
+                rtt.sample(monotonic() - sent_at)
+            if wanted < total and wanted in acked and acked_at.get(wanted,0) < sent_at:
+                #The robot asks for a packet it acked before this one went out, not a late answer overtaken by newer
+                #ones: it lost it, and whatever it has not acked since
+                lost = {i for i in acked if i >= wanted and acked_at.get(i,0) < sent_at} | {wanted}
+                acked -= lost
+                for i in lost:
+                    acked_at.pop(i,None)
+                session.unack(lost)
+                print(f'Robot {serial} lost {len(lost)} packets, sending them again')
+                for i in sorted(lost):
+                    if i != wanted and i not in flight and i not in missing:
+                        resent.add(i)
+                        missing.append(i)
+                        self.metrics.inc('radio_retries_total',packet='upload_scen')
+            newly = {stored} | set(range(min(wanted,total)))
+            newly = {i for i in newly if i < total} - acked
+            if newly:
+                failures = 0
+                acked |= newly
+                acked_at.update(dict.fromkeys(newly,monotonic()))
+                session.ack(newly)
+                print(f'Packet {len(acked)}/{total} accepted')
+            if idx not in acked and idx not in missing:
+                resent.add(idx)
+                missing.append(idx)
+                self.metrics.inc('radio_retries_total',packet='upload_scen')
+            if wanted < total and wanted not in acked and wanted not in flight and wanted not in missing:
+                #The robot skipped ahead of a gap, resend just that index
+                resent.add(wanted)
+                missing.append(wanted)
+                self.metrics.inc('radio_retries_total',packet='upload_scen')
+            missing.sort()
+
+        session.finish()
+        return len(acked) == total
 
 
     
 
 class Htt(Requests):
     def __init__(self, **kwargs):
-        self.sentZero = False
+        #Robots whose last drive was already the zero vector
+        self.sentZero = set()
         super().__init__(**kwargs)
     
     def info_system(self,serial=1204):
@@ -477,13 +1129,13 @@ class Htt(Requests):
         return info
     
     def cmd_drive(self,jx=0,jy=-0,jz=0,serial=1204):
-        if jx ==  0 and jy == 0 and jz==0 and self.sentZero:
+        if jx ==  0 and jy == 0 and jz==0 and serial in self.sentZero:
             return 0
-        elif jx ==  0 and jy == 0 and jz==0 and  (not self.sentZero):
-            self.sentZero = True
+        elif jx ==  0 and jy == 0 and jz==0 and  (serial not in self.sentZero):
+            self.sentZero.add(serial)
         else:
-            self.sentZero = False
-        return self.command('joy',jx=jx,jy=jy,jz=jz,serial=serial)
+            self.sentZero.discard(serial)
+        return self.radio.post(self.pb.drive(serial,1,jx,jy,jz))
     
     def cmd_select(self,status=0,serial=1204):
         return self.command('joy',jb=status,serial=serial)
@@ -492,14 +1144,17 @@ class Htt(Requests):
         jz = int(dir*100)
         return self.command('joy',jz=jz,serial=serial)
     
-    def cmd_upload(self,name,date, time, origin,waypoints):
-        return self.uploader(name,date, time, origin,waypoints)
+    def cmd_upload(self,name,date, time, origin,waypoints,serial=1204,window=4):
+        return self.uploader(name,date, time, origin,waypoints,serial,window)
+
+    def upload_progress(self,serial=None):
+        return self.uploads.progress(serial)
     
-    def cmd_stop(self):
-        return self.supercommand('joy')
+    def cmd_stop(self,serial=1204):
+        return self.supercommand('joy',serial=serial)
     
-    def cmd_select_target(self,target=1):
-        return self.supercommand('select_target',target=target)
+    def cmd_select_target(self,target=1,serial=1204):
+        return self.supercommand('select_target',lane='command',target=target,serial=serial)
 
     
 
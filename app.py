@@ -3,34 +3,46 @@ from PIL import Image, ImageDraw
 from genfeed import generate_frames
 # import simplified_radio
 from vectors_ import Vector
+import json
+import os
 import time
-from functools import wraps
 from flask import g
-from HTT import Htt
+from HTT import Htt, PRIORITY, RadioUnavailable
 from gpstransformer import latLong2UTM, UTM2LonLat
+from telemetry import TelemetryCache, TelemetryPoller, TelemetryStream
+from fleet import Fleet
+from metrics import REGISTRY as METRICS
+from recorder import FlightRecorder
+from logindex import KINDS, SegmentIndex, TelemetryLog
+from pathsimplify import simplify
+from joystick import CommandThrottle, JoystickChannel
 import gen_qr
-
-HTT = Htt()
-PAUSE = False
+#Optional, adds WebSocket versions of the streaming routes
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+#Every radio frame of the session goes to recordings/<start time>/
+RECORDER = FlightRecorder(index=SegmentIndex).start()
+#Past and present sessions, queried through the indexes the recorder keeps next to each segment
+RECORDINGS = TelemetryLog(os.path.dirname(RECORDER.directory))
+#Robots in flight at once on the radio, the poller keeps as many telemetry requests in the air
+WINDOW = 4
+#USB radios to drive, HTT_RADIOS=all (default) follows every radio as it is plugged in and out,
+#or a comma-separated list of ports, e.g. HTT_RADIOS=/dev/ttyUSB0,/dev/ttyUSB1. Robots are sharded over them
+RADIOS = os.environ.get('HTT_RADIOS','all')
+HTT = Htt(ports=RADIOS if RADIOS == 'all' else [port.strip() for port in RADIOS.split(',') if port.strip()],
+          recorder=RECORDER,window=WINDOW)
+FLEET = Fleet()
+#Every decoded update goes out to the pages subscribed to /_telemetry/stream
+STREAM = TelemetryStream()
+TELEMETRY = TelemetryCache(stream=STREAM)
+POLLER = TelemetryPoller(HTT,TELEMETRY,FLEET,window=WINDOW)
+POLLER.start()
 scens = {}
-last_time = time.time()
-
-#Base requirment
-def rate_limit(f):
-    
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        global last_time
-        current_time = time.time()
-        print(current_time-last_time)
-        if abs(current_time-last_time) < 0.25:
-            # print('Too Fast')
-            return {'301':'too fast'}, 301
-        else:
-            last_time = current_time
-        return f(*args, **kwargs)
-        
-    return decorated_function
+#Stick input per operator and robot, faster input is merged into the newest instead of refused
+THROTTLE = CommandThrottle(rate=10.0,burst=2)
 
 
 WAYPOINTS = {}
@@ -42,7 +54,71 @@ def intify(x):
     print('BEFORE INTIFY',x)
     return int(round(float(x),0))
 
+
+class SerialError(Exception):
+    #A control request that names no usable robot, answered with status instead of a 500
+    def __init__(self,message,status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def robot_serial(data):
+    #Requests may name a robot, otherwise the fleet's active robot is meant
+    serial = data.get('SERIAL')
+    if serial is None:
+        if FLEET.active is None:
+            raise SerialError('no active robot',404)
+        return FLEET.active
+    try:
+        return int(serial)
+    except (TypeError,ValueError):
+        raise SerialError(f'invalid serial {serial!r}')
+
+
+def drive_joystick(power,angle,serial=None):
+    #Stick power 0..1 and angle in radians to the robot's drive vector, None drives the active robot
+    joystick_v = 100*Vector(mag=float(power),theta=float(angle),deg=False)
+    jx = -1*int(round(joystick_v[0]))
+    jy = int(round(joystick_v[1]))
+    return HTT.cmd_drive(jx,jy,0,robot_serial({}) if serial is None else serial)
+
+
+def joystick_input(session):
+    #drive() for one operator's JoystickChannel, through that operator's buckets
+    def drive(power,angle,serial):
+        serial = robot_serial({}) if serial is None else serial
+        return THROTTLE.submit((session,serial),drive_joystick,power,angle,serial)
+    return drive
+
+
+def robot_summary(serial):
+    gps = TELEMETRY.get(serial,'gps')
+    system = TELEMETRY.get(serial,'system')
+    battery = TELEMETRY.get(serial,'battery')
+    summary = {'serial':serial,'name':FLEET.name(serial)}
+    if gps and gps['serial'] != 0:
+        lat,lon = UTM2LonLat(gps['utmX'],gps['utmY'])
+        summary.update({'lat':lat,'lon':-90+lon,'speed':gps['speed'],'COG':gps['COG'],
+                        'numSat':gps['numSat'],'gpsFix':gps['gpsFix']})
+    if system:
+        summary.update({'state':system['state'],'errorbits':system['errorbits']})
+    if battery:
+        summary.update({'bvolt':battery['bvolt'],'bcap':battery['bcap']})
+    return summary
+
 app = Flask(__name__)
+SOCK = Sock(app) if Sock else None
+
+
+@app.errorhandler(RadioUnavailable)
+def radio_unavailable(e):
+    #Answer at once while the radio is unplugged, it reconnects in the background
+    return jsonify({'error':'radio unavailable','detail':str(e)}), 503
+
+
+@app.errorhandler(SerialError)
+def serial_error(e):
+    return jsonify({'error':str(e)}), e.status
 
 # Distinct Pages
 @app.route('/')
@@ -82,33 +158,72 @@ def download():
 def statistics():
     return render_template('statistics.html')
 
+
+@app.route('/_statistics/summary',methods=['GET'])
+def _statistics_summary():
+    summary = RECORDINGS.summary()
+    for robot in summary['robots']:
+        robot['name'] = FLEET.name(robot['serial']) if robot['serial'] in FLEET else None
+    return jsonify(summary)
+
+
+@app.route('/_statistics/query',methods=['GET'])
+def _statistics_query():
+    #KIND gps/battery/hit/system, START and END in epoch seconds, SERIAL repeated per robot, at most MAX rows evenly spread
+    kind = request.args.get('KIND','gps')
+    if kind not in KINDS:
+        return {'error':f'Unknown kind {kind}'}, 400
+    limit = request.args.get('MAX',2000,type=int)
+    if limit < 1:
+        return {'error':f'MAX must be at least 1, not {limit}'}, 400
+    serials = request.args.getlist('SERIAL',type=int) or None
+    RECORDER.flush(1.0)
+    columns = RECORDINGS.query(kind,request.args.get('START',None,type=float),request.args.get('END',None,type=float),serials)
+    rows = len(columns['time'])
+    step = max(1,-(-rows//limit))
+    return jsonify({'kind':kind,
+                    'rows':rows,
+                    'columns':{name:column[::step].tolist() for name,column in columns.items()}})
+
 # Joystick backend
 
 @app.route('/_joystick', methods=['POST'])
-@rate_limit
 def joystick():
     data = request.get_json()
     power = data.get('POWER', '0')
     angle = data.get('ANGLE', '0')
     print(f'Power: {power}\nAngle: {angle}')
-    
-
-    joystick_v = 100*Vector(mag=float(power),theta=float(angle),deg=False)
-    print(joystick_v)
+    serial = robot_serial(data)
+    #SESSION tells apart operators sharing an address
+    session = data.get('SESSION',request.remote_addr)
     try:
-        jx = -1*intify(joystick_v[0])
-        jy = intify(joystick_v[1])
-        jz = 0
-        print('jx', float(jx),'jy ',float(jy))
-        HTT.cmd_drive(jx,jy,jz,1204)
-        # simplified_radio.sendJoyStickCMD(jx,jy,0)
+        if not THROTTLE.submit((session,serial),drive_joystick,power,angle,serial):
+            #Held for the next token, a newer input before then takes its place
+            return {'Bet':'Got it','held':True}, 202
+    except RadioUnavailable:
+        raise
     except Exception as e:
         print(e)
     return {'Bet':'Got it'}, 200
 
+
+if SOCK is not None:
+    @SOCK.route('/_joystick/ws')
+    def _joystick_ws(ws):
+        #One connection per operator, stick updates and pongs in, acks with the round trip out, see joystick.py
+        channel = JoystickChannel(joystick_input(f'ws-{id(ws)}'))
+        while True:
+            reply = channel.handle(ws.receive())
+            if reply is not None:
+                ws.send(reply)
+
 @app.route('/stopit', methods=['POST','GET'])
 def stopit():
-    HTT.cmd_stop()
+    data = request.get_json(silent=True) or {}
+    serial = robot_serial(data)
+    #Held stick input would otherwise go out after the stop and start the robot again
+    THROTTLE.discard(serial)
+    HTT.cmd_stop(serial)
     return {'Bet':'Got it'}, 200
 
 @app.route('/_joystick_b', methods=['POST'])
@@ -117,7 +232,7 @@ def joystickb():
     power = data.get('POWER', '0')
     angle = data.get('ANGLE', '0')
     print(f'Power: {power}\nAngle: {angle}')
-    
+    serial = robot_serial(data)
 
     joystick_v = 100*Vector(mag=float(power),theta=float(angle),deg=False)
     print(joystick_v)
@@ -126,8 +241,10 @@ def joystickb():
         jy = intify(joystick_v[1])
         jz = 0
         print('jx', float(jx),'jy ',float(jy))
-        HTT.cmd_drive(jx,jy,jz,1204)
+        HTT.cmd_drive(jx,jy,jz,serial)
         # simplified_radio.sendJoyStickCMD(jx,jy,0)
+    except RadioUnavailable:
+        raise
     except Exception as e:
         print(e)
     return {'Bet':'Got it'}, 200
@@ -138,10 +255,12 @@ def joystickb():
 def select():
     data = request.get_json()
     status = data.get('status', '0')
-    
+    serial = robot_serial(data)
     try:
-        HTT.cmd_select(status)
+        HTT.cmd_select(status,serial)
         
+    except RadioUnavailable:
+        raise
     except Exception as e:
         print(e)
     return {'Bet':'Got it'}, 200
@@ -150,11 +269,13 @@ def select():
 def twist():
     data = request.get_json()
     dir = data.get('dir', '1')
-    
+    serial = robot_serial(data)
     try:
-        HTT.cmd_twist(dir)
-        HTT.cmd_twist(0)
+        HTT.cmd_twist(dir,serial)
+        HTT.cmd_twist(0,serial)
         
+    except RadioUnavailable:
+        raise
     except Exception as e:
         print(e)
     return {'Bet':'Got it'}, 200
@@ -174,7 +295,7 @@ def buttons():
         'down':HTT.cmd_down,
         'up':HTT.cmd_up,
         'Mode:Shift':HTT.cmd_half,
-        'Mode:RC':HTT.info_gps,
+        'Mode:RC':lambda serial: TELEMETRY.snapshot(serial),
         'Scenario:Start':HTT.cmd_onoff,
         'Targets:1':HTT.cmd_select_target,
         'Targets:2':HTT.cmd_select_target,
@@ -188,12 +309,14 @@ def buttons():
     } 
     data = request.get_json()
     button = data.get('BUTTON', '0')
+    #Every button goes to the robot the request names, else the fleet's active robot
+    serial = robot_serial(data)
     if button != 'Mode:RC' and 'Targets' not in button:
-        button_map[button]()
+        button_map[button](serial=serial)
     elif 'Targets' in button:
-        button_map[button](int(button.split(':')[1]))
+        button_map[button](int(button.split(':')[1]),serial=serial)
     else:
-        info = button_map[button]()
+        info = button_map[button](serial)
         [print(data, info[data]) for data in info]
 
     print('Button: ',button)
@@ -227,34 +350,42 @@ def add_waypoints():
 # Joystick backend
 @app.route('/_gps/make_scen', methods=['POST'])
 def upload_scen():
-    global WAYPOINTS, PAUSE
+    global WAYPOINTS
     data = request.get_json()
     target = data.get('TAR', None)
     name = data.get('NAME','DefualtName')
     WAYPOINTS[target]['name'] = name
-    selected = WAYPOINTS[target]
+    selected = dict(WAYPOINTS[target])
+    #Optional tolerance in metres, near-collinear clicks cost a packet each otherwise
+    tolerance = float(data.get('TOLERANCE',0))
+    selected['waypoints'],report = simplify(selected['waypoints'],tolerance,data.get('METHOD','dp'))
     print(selected)
-    PAUSE = True
-    time.sleep(1)
-    HTT.cmd_upload(**selected)
-    time.sleep(5)
-    PAUSE = False
+    print('Simplified: ',report)
+    POLLER.pause()
+    try:
+        uploaded = HTT.cmd_upload(serial=robot_serial(data),**selected)
+    finally:
+        POLLER.resume()
     
-    return {'Bet':''}, 200
+    return {'Bet':'','uploaded':uploaded,'simplify':report}, 200
+
+
+@app.route('/_gps/upload_progress',methods=['GET'])
+def upload_progress():
+    serial = request.args.get('SERIAL',None,type=int)
+    return jsonify(HTT.upload_progress(serial))
 
 
 @app.route('/_gps/info',methods=['GET'])
 def _gps_info():
-    global PAUSE
     lat,lon = 36.78021105,13.4600115
     try:
-        if not PAUSE:
-            print('Not pause')
-            gps_info = HTT.info_gps()
-            serial = gps_info['serial']
-            speed = gps_info['speed']
-            utmx = gps_info['utmX']
-            utmy = gps_info['utmY']
+        #Served from the poller's cache, browsers never wait on the radio
+        gps_info = TELEMETRY.get(FLEET.active,'gps')
+        serial = gps_info['serial']
+        speed = gps_info['speed']
+        utmx = gps_info['utmX']
+        utmy = gps_info['utmY']
 
         if serial != 0:
             lat,lon = UTM2LonLat(utmx,utmy)
@@ -273,12 +404,133 @@ def _gps_info():
 
 
 
+@app.route('/_fleet',methods=['GET','POST'])
+def _fleet():
+    if request.method == 'POST':
+        data = request.get_json()
+        serial = int(data.get('SERIAL'))
+        action = data.get('ACTION','add')
+        if action == 'add':
+            FLEET.add(serial,data.get('NAME'))
+        elif action == 'remove':
+            FLEET.remove(serial)
+        elif action == 'select':
+            if serial not in FLEET:
+                return {'error':f'Robot {serial} is not in the fleet'}, 404
+            FLEET.select(serial)
+    return jsonify({'active':FLEET.active,
+                    'robots':{serial:FLEET.name(serial) for serial in FLEET.serials()}})
+
+
+@app.route('/_fleet/info',methods=['GET'])
+def _fleet_info():
+    return jsonify({'active':FLEET.active,
+                    'robots':[robot_summary(serial) for serial in FLEET.serials()]})
+
+
+@app.route('/_telemetry/<int:serial>',methods=['GET'])
+def _telemetry(serial):
+    return jsonify(TELEMETRY.snapshot(serial))
+
+
+#Seconds between keepalives on an idle stream, also how soon a closed one is noticed
+STREAM_KEEPALIVE = 15.0
+
+
+def telemetry_event(stamp,serial,field,value):
+    event = {'serial':serial,'field':field,'time':stamp,'active':FLEET.active,'data':value}
+    if field == 'gps' and value.get('serial'):
+        #Same map position as /_gps/info
+        lat,lon = UTM2LonLat(value['utmX'],value['utmY'])
+        event.update({'lat':lat,'lon':-90+lon})
+    return event
+
+
+def telemetry_subscription():
+    #SERIAL and FIELD may repeat to narrow the stream, every robot and field by default
+    serials = request.args.getlist('SERIAL',type=int) or None
+    fields = request.args.getlist('FIELD') or None
+    subscription = STREAM.subscribe(serials,fields)
+    #What is known already goes first, then every update as the radio thread decodes it
+    for serial in serials or FLEET.serials():
+        for field in fields or TelemetryPoller.fields:
+            value = TELEMETRY.get(serial,field)
+            if value is not None:
+                subscription.put((time.time(),serial,field,value))
+    return subscription
+
+
+@app.route('/_telemetry/stream',methods=['GET'])
+def _telemetry_stream():
+    #Server-Sent Events, one event per decoded update named after its field
+    subscription = telemetry_subscription()
+
+    def events():
+        try:
+            while True:
+                event = subscription.get(STREAM_KEEPALIVE)
+                if event is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: {event[2]}\ndata: {json.dumps(telemetry_event(*event))}\n\n'
+        finally:
+            STREAM.unsubscribe(subscription)
+
+    return Response(events(),mimetype='text/event-stream',headers={'Cache-Control':'no-cache','X-Accel-Buffering':'no'})
+
+
+if SOCK is not None:
+    @SOCK.route('/_telemetry/ws')
+    def _telemetry_ws(ws):
+        #The same updates as /_telemetry/stream, one JSON message each
+        subscription = telemetry_subscription()
+        try:
+            while ws.connected:
+                event = subscription.get(STREAM_KEEPALIVE)
+                if event is not None:
+                    ws.send(json.dumps(telemetry_event(*event)))
+        finally:
+            STREAM.unsubscribe(subscription)
+
+
+@app.route('/_radio/stats',methods=['GET'])
+def _radio_stats():
+    stats = {lane:HTT.radio.latency(lane) for lane in PRIORITY}
+    stats['coalesced'] = HTT.radio.coalesced
+    stats['joystick'] = THROTTLE.stats()
+    stats['connected'] = HTT.radio.connected
+    stats['ports'] = HTT.radio.stats()
+    return jsonify(stats)
+
+
+@app.route('/metrics',methods=['GET'])
+def _metrics():
+    #Prometheus text format: stage latency histograms per packet type, drops and timeouts, link state per radio
+    gauges,totals = [],[]
+    for port,stats in HTT.radio.stats().items():
+        labels = {'port':port}
+        gauges += [('radio_connected',labels,stats['connected']),
+                   ('radio_queued',labels,stats['queued']),
+                   ('radio_in_flight',labels,stats['in_flight'])]
+        totals += [('radio_reconnects_total',labels,stats['reconnects']),
+                   ('radio_tx_packets_total',labels,stats['tx']),
+                   ('radio_rx_packets_total',labels,stats['rx']),
+                   ('radio_tx_bytes_total',labels,stats['tx_bytes']),
+                   ('radio_rx_bytes_total',labels,stats['rx_bytes'])]
+    streamed = STREAM.stats()
+    gauges.append(('telemetry_subscribers',{},streamed['subscribers']))
+    totals += [('telemetry_published_total',{},streamed['published']),
+               ('telemetry_dropped_total',{},streamed['dropped'])]
+    recorded = RECORDER.stats()
+    totals += [('recorder_frames_total',{},recorded['records']),
+               ('recorder_dropped_total',{},recorded['dropped'])]
+    return Response(METRICS.render(gauges,totals),mimetype='text/plain; version=0.0.4')
+
+
 # Joystick backend
 @app.route('/_power')
 def power():
-
-    
-    HTT.cmd_onoff()
+    HTT.cmd_onoff(robot_serial(request.args))
     return redirect(url_for('controler'))
 
 
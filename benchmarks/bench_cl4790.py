@@ -0,0 +1,81 @@
+"""
+TDMA load test of HTTRadioController against the emulated CL4790 (cl4790_emulator.py).
+
+Runs the controller with 8, 16 and 32 clients at several slot times and reports
+the cycle time it actually achieves, how many of the requested responses came
+back and the average comm performance the GUI would show once its window fills.
+
+    python benchmarks/bench_cl4790.py [--clients 8 16 32] [--slots 0.1 0.05 0.02] [--seconds 3] [--loss 0.05]
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cl4790_emulator import CL4790Emulator
+
+
+def load(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+#HTT-Direct.py imports the CL4790 driver as "radio" but it ships as radio-direct.py
+load('radio', 'radio-direct.py')
+direct = load('htt_direct', 'HTT-Direct.py')
+
+
+def run(clients, slot_time, seconds, latency, jitter, loss):
+    with CL4790Emulator(clients, latency=latency, jitter=jitter, loss=loss, seed=1) as emulator:
+        controller = direct.HTTRadioController(serial_port=emulator.port, num_clients=clients, slot_time=slot_time)
+        if not controller.start():
+            raise RuntimeError(f'Controller did not start on {emulator.port}')
+        time.sleep(seconds)
+        start, cycle = time.monotonic(), controller.cycle
+        sent = sum(client.msg_sent for client in controller.clients)
+        recv = sum(client.msg_recv for client in controller.clients)
+        time.sleep(seconds)
+        elapsed, cycles = time.monotonic() - start, controller.cycle - cycle
+        sent = sum(client.msg_sent for client in controller.clients) - sent
+        recv = sum(client.msg_recv for client in controller.clients) - recv
+        #get_comm_performance divides by the full window, scale it to the samples a short run has taken
+        perf = sum(controller.get_comm_performance(client.id) * direct.COMM_PERF_SIZE
+                   / min(direct.COMM_PERF_SIZE, client.msg_sent)
+                   for client in controller.clients if client.msg_sent) / clients
+        controller.stop()
+    slot = elapsed / cycles if cycles else float('nan')
+    #Answers still in flight when the window closes count as lost, so allow one
+    lost = max(0, sent - recv - 1) / sent if sent else float('nan')
+    return slot, slot * clients, lost, perf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--slots', type=float, nargs='+', default=[0.1, 0.05, 0.02], help='slot times in seconds')
+    parser.add_argument('--seconds', type=float, default=3.0, help='warm up, then measure for as long again')
+    parser.add_argument('--latency', type=float, default=0.008, help='seconds until a client answers')
+    parser.add_argument('--jitter', type=float, default=0.004)
+    parser.add_argument('--loss', type=float, default=0.05, help='chance a packet or its answer is lost')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f'latency {args.latency * 1e3:.0f} ms + {args.jitter * 1e3:.0f} ms jitter, {args.loss:.0%} loss per hop\n')
+    print(f'{"clients":>8}{"slot ms":>10}{"real ms":>10}{"cycle ms":>10}{"lost":>8}{"perf":>8}')
+    for clients in args.clients:
+        for slot_time in args.slots:
+            slot, cycle, lost, perf = run(clients, slot_time, args.seconds, args.latency, args.jitter, args.loss)
+            print(f'{clients:>8}{slot_time * 1e3:>10.0f}{slot * 1e3:>10.1f}{cycle * 1e3:>10.0f}{lost:>8.1%}{perf:>7.0f}%')
+
+
+if __name__ == '__main__':
+    main()
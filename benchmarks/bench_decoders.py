@@ -0,0 +1,81 @@
+"""
+Microbenchmark for Decoders: cost per gps response and per recorded session.
+
+Compares the table-driven struct decoders in HTT.Decoders with the shift-and-mask
+decoder they replaced (kept below as legacy_gps), and decode_many against a
+per-frame loop over the same buffer.
+
+    python benchmarks/bench_decoders.py [-n 200000] [--frames 1000000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HTT import Decoders
+
+
+def legacy_gps(pack):
+    data = {}
+    data['paylength'] = pack[1]
+    data['serial'] = (pack[3] << 8) | (pack[2] & 0xFF)
+    raw_utmX = ((pack[4+3] << 24) | (pack[4+2] << 16) | (pack[4+1] << 8) | (pack[4+0] & 0xFF))
+    raw_utmY = ((pack[4+7] << 24) | (pack[4+6] << 16) | (pack[4+5] << 8) | (pack[4+4] & 0xFF))
+    data['utmX'] = raw_utmX / 10.
+    data['utmY'] = raw_utmY / 10.
+    data['utmZone'] = [pack[4+8], pack[4+9], pack[4+10], pack[4+11]]
+    data['numSat'] = pack[4+12]
+    data['gpsFix'] = pack[4+13]
+    data['COG'] = pack[4+14]
+    data['speed'] = pack[4+15]
+    return data
+
+
+def report(label, seconds, n, unit='ns/op', scale=1e9):
+    print(f'{label:<28}{seconds / n * scale:10.0f} {unit}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', type=int, default=200000, help='decodes per measurement')
+    parser.add_argument('--frames', type=int, default=1000000, help='gps frames in the session buffer')
+    args = parser.parse_args()
+
+    dc = Decoders()
+    rng = random.Random(1)
+    frame = bytes([0x0D, 16, 0xB4, 0x04] + [rng.randrange(256) for _ in range(16)])
+    assert legacy_gps(frame) == dc.gps(frame)
+
+    n = args.n
+    old = min(timeit.repeat(lambda: legacy_gps(frame), number=n, repeat=5))
+    new = min(timeit.repeat(lambda: dc.gps(frame), number=n, repeat=5))
+    report('gps, legacy', old, n)
+    report('gps, struct', new, n)
+    print(f'{"speed-up":<28}{old / new:10.2f} x')
+
+    session = rng.randbytes(20 * args.frames)
+    session = bytearray(session)
+    session[0::20] = b'\x0D' * args.frames
+    session[1::20] = b'\x10' * args.frames
+    session = bytes(session)
+
+    start = time.perf_counter()
+    rows = [legacy_gps(session[i:i + 20]) for i in range(0, len(session), 20)]
+    old = time.perf_counter() - start
+    start = time.perf_counter()
+    columns = dc.decode_many('gps', session)
+    new = time.perf_counter() - start
+    assert len(columns['utmX']) == len(rows) and columns['utmX'][-1] == rows[-1]['utmX']
+    print(f'{args.frames} gps frames')
+    report('  per-frame legacy loop', old, 1, 'ms', 1e3)
+    report('  decode_many', new, 1, 'ms', 1e3)
+    print(f'{"speed-up":<28}{old / new:10.2f} x')
+
+
+if __name__ == '__main__':
+    main()
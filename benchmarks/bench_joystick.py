@@ -0,0 +1,246 @@
+"""
+End-to-end joystick latency from POST /_joystick to bytes on the serial line.
+
+Simulated clients drive app.py through the Flask test client, each steering
+its own robot of the emulated USB radio (usb_emulator.py). Every request goes
+through the CommandThrottle, Vector, Htt.cmd_drive, PacketBuilder and the
+RadioStack.
+The emulator timestamps each joy packet it receives, which gives the time
+from the HTTP request to the matching vector on the wire.
+
+With --transport channel the clients send the same updates as JSON frames
+through joystick.JoystickChannel, what /_joystick/ws runs per connection,
+instead of one POST each. The http columns are then the time to the ack.
+
+Results can be saved as JSON and compared against an earlier run:
+
+    python benchmarks/bench_joystick.py [--clients 1 4 8] [--rate 20] [--seconds 5] [--transport http] [--out after.json] [--baseline before.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from joystick import JoystickChannel
+from protocol import USB
+from usb_emulator import UsbRadioEmulator
+from vectors_ import Vector
+
+#Compared against the baseline, lower is better for all but throughput
+METRICS = ('http_p50', 'http_p99', 'http_max', 'wire_p50', 'wire_p99', 'wire_max')
+
+
+class WireTap(UsbRadioEmulator):
+    #Notes when each joy packet reaches the radio, before the robot's answer is delayed
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.joys = {robot.serial: [] for robot in self.robots.values()}
+
+    def receive(self, packet):
+        if packet[4] == USB.types['joy']:
+            robot = self.robots.get((packet[2], packet[3]))
+            if robot is not None:
+                self.joys[robot.serial].append((time.monotonic(), packet[6] - 100, packet[7] - 100))
+        super().receive(packet)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def expected(power, angle):
+    #Same vector math as the /_joystick route
+    v = 100 * Vector(mag=power, theta=angle, deg=False)
+    return -int(round(v[0])), int(round(v[1]))
+
+
+def load_app(port):
+    #app.py builds its Htt and the QR code at import, do that in a scratch directory, then point it at the emulator
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp()
+    os.makedirs(os.path.join(scratch, 'static'))
+    shutil.copy(os.path.join(ROOT, 'static', 'not_avalible.jpg'), os.path.join(scratch, 'static'))
+    os.chdir(scratch)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+            from HTT import Htt
+            app.POLLER.stop()
+            app.HTT = Htt(port=port)
+    finally:
+        os.chdir(cwd)
+    app.HTT.radio.online.wait(5)
+    return app
+
+
+def drive(app, serial, rate, stop, sent, http, statuses, transport):
+    client = app.app.test_client()
+    channel = JoystickChannel(app.joystick_input(f'bench-{serial}'))
+    angle = serial * 0.7
+    interval = 1 / rate if rate else 0
+    due = time.monotonic()
+    while time.monotonic() < stop:
+        #Walk the stick around the circle so consecutive vectors differ
+        angle += 0.05
+        power = 0.4 + 0.5 * ((serial + len(http)) % 7) / 7
+        start = time.monotonic()
+        if transport == 'channel':
+            ack = json.loads(channel.handle(json.dumps({'seq': len(http), 't': start * 1000,
+                                                         'POWER': power, 'ANGLE': angle, 'SERIAL': serial})))
+            #The page answers every ack at once so the server can time the round trip
+            if 'st' in ack:
+                channel.handle(json.dumps({'pong': ack['st']}))
+            status = 503 if 'error' in ack else 200
+        else:
+            status = client.post('/_joystick', json={'POWER': power, 'ANGLE': angle, 'SERIAL': serial}).status_code
+        elapsed = time.monotonic() - start
+        statuses[status] = statuses.get(status, 0) + 1
+        #202 is held for the throttle's next token, it reaches the wire unless a newer input replaces it
+        if status in (200, 202):
+            http.append(elapsed)
+            sent.append((start, serial, expected(power, angle)))
+        if interval:
+            due += interval
+            time.sleep(max(0, due - time.monotonic()))
+
+
+def match(sent, joys):
+    #Time from each accepted request to the first packet on the wire carrying its vector
+    wire, superseded = [], 0
+    for start, serial, vector in sent:
+        hit = next((t for t, jx, jy in joys[serial] if t >= start and (jx, jy) == vector), None)
+        if hit is None:
+            superseded += 1
+        else:
+            wire.append(hit - start)
+    return wire, superseded
+
+
+def run(app, emulator, clients, rate, seconds, transport='http'):
+    serials = list(emulator.joys)[:clients]
+    for serial in serials:
+        emulator.joys[serial].clear()
+    sent, http, statuses = [], [], {}
+    coalesced = app.HTT.radio.coalesced
+    throttled = app.THROTTLE.stats()['coalesced']
+    stop = time.monotonic() + seconds
+    threads = [threading.Thread(target=drive, args=(app, serial, rate, stop, sent, http, statuses, transport))
+               for serial in serials]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        #Let the last vectors reach the wire
+        time.sleep(0.3)
+    wire, superseded = match(sent, emulator.joys)
+    requests = sum(statuses.values())
+    return {
+        'clients': clients,
+        'rate': rate,
+        'requests': requests,
+        'requests_per_s': requests / seconds,
+        'commands_per_s': len(sent) / seconds,
+        'on_wire_per_s': sum(len(emulator.joys[s]) for s in serials) / seconds,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'superseded': superseded,
+        'coalesced': app.HTT.radio.coalesced - coalesced,
+        'throttled': app.THROTTLE.stats()['coalesced'] - throttled,
+        'http_p50': percentile(http, 0.5),
+        'http_p99': percentile(http, 0.99),
+        'http_max': max(http, default=float('nan')),
+        'wire_p50': percentile(wire, 0.5),
+        'wire_p99': percentile(wire, 0.99),
+        'wire_max': max(wire, default=float('nan')),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def compare(results, baseline, tolerance):
+    #Prints the change per metric and returns how many got worse than the tolerance
+    before = {(r['clients'], r['rate']): r for r in baseline['results']}
+    worse = 0
+    print(f'\nagainst {baseline.get("revision") or "baseline"} ({baseline.get("time", "")})')
+    for result in results:
+        old = before.get((result['clients'], result['rate']))
+        if old is None:
+            continue
+        changes = []
+        for metric in METRICS + ('commands_per_s',):
+            if not old[metric] or old[metric] != old[metric]:
+                continue
+            change = result[metric] / old[metric] - 1
+            bad = -change if metric == 'commands_per_s' else change
+            if bad > tolerance:
+                worse += 1
+            changes.append(f'{metric} {change:+.0%}{" !" if bad > tolerance else ""}')
+        print(f'{result["clients"]:>3} clients: ' + ', '.join(changes))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 8], help='concurrent simulated clients')
+    parser.add_argument('--rate', type=float, default=20.0, help='requests per second per client, 0 for flat out')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--transport', choices=('http', 'channel'), default='http',
+                        help='one POST per update, or JSON frames through a JoystickChannel')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per robot answer')
+    parser.add_argument('--out', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before a metric counts as worse')
+    args = parser.parse_args()
+
+    emulator = WireTap(max(args.clients), latency=args.latency, seed=1)
+    emulator.start()
+    app = load_app(emulator.port)
+    results = []
+    print(f'{"clients":>8}{"req/s":>8}{"cmd/s":>8}{"wire/s":>8}{"http p50":>10}{"p99":>8}{"max":>8}'
+          f'{"wire p50":>10}{"p99":>8}{"max":>8}  statuses')
+    try:
+        for clients in args.clients:
+            r = run(app, emulator, clients, args.rate, args.seconds, args.transport)
+            results.append(r)
+            ms = {metric: r[metric] * 1e3 for metric in METRICS}
+            print(f'{clients:>8}{r["requests_per_s"]:>8.1f}{r["commands_per_s"]:>8.1f}{r["on_wire_per_s"]:>8.1f}'
+                  f'{ms["http_p50"]:>10.1f}{ms["http_p99"]:>8.1f}{ms["http_max"]:>8.1f}'
+                  f'{ms["wire_p50"]:>10.1f}{ms["wire_p99"]:>8.1f}{ms["wire_max"]:>8.1f}  {r["statuses"]}')
+    finally:
+        app.HTT.radio.close()
+        emulator.stop()
+
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': git_revision(),
+              'python': platform.python_version(), 'args': vars(args), 'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nsaved to {args.out}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = compare(results, json.load(f), args.tolerance)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Query time over recorded telemetry with and without the segment indexes (logindex.py).
+
+Writes a synthetic session (bench_replay.synthesize) with the index kept live
+by the recorder, then asks for one robot's answers in a short window both
+through TelemetryLog.query and by scanning and decoding the whole recording.
+The two results are compared column by column. The indexes are also rebuilt
+from scratch with one worker process and with several.
+
+    python benchmarks/bench_logindex.py [--pairs 200000] [--robots 8] [--window 60] [--workers 4]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_replay import synthesize
+from HTT import Decoders, ResponseMatcher
+from logindex import KINDS, SegmentIndex, TelemetryLog, build_indexes
+from recorder import TX, read_recording
+
+
+def full_scan(directory, kind, start, end, serials):
+    #The same answer without an index: every record read, matched and filtered
+    decoder = Decoders()
+    layout = KINDS[kind]
+    size = decoder.layouts[layout].size
+    matcher = ResponseMatcher()
+    times, frames = [], []
+    for record in read_recording(directory):
+        if record.protocol != 'usb':
+            continue
+        if record.direction == TX:
+            matcher.sent(record.frame)
+            continue
+        frame = record.frame
+        if matcher.answered(frame) == layout and start <= record.wall <= end and record.serial in serials \
+           and len(frame) >= size and frame[0] == 0x0D and 4 + frame[1] == len(frame):
+            times.append(record.wall)
+            frames.append(frame)
+    columns = decoder.decode_many(layout, frames)
+    columns['time'] = np.array(times)
+    return columns
+
+
+def best(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pairs', type=int, default=200000, help='request/answer pairs to record')
+    parser.add_argument('--robots', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between recorded requests')
+    parser.add_argument('--segment-mb', type=float, default=1)
+    parser.add_argument('--window', type=float, default=60, help='seconds of traffic to query')
+    parser.add_argument('--workers', type=int, default=4, help='processes for the parallel rebuild')
+    args = parser.parse_args()
+
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as directory:
+        segment_size = int(args.segment_mb * (1 << 20))
+        for label, index in (('record', None), ('record + live index', SegmentIndex)):
+            start = time.perf_counter()
+            written = synthesize(os.path.join(directory, label), args.pairs, args.robots, args.interval,
+                                 segment_size=segment_size, index=index)
+            print(f'{label:<24}{written["records"]:>9} frames{time.perf_counter() - start:>8.2f} s')
+        session = os.path.join(directory, 'record + live index')
+        print(f'{written["segments"]} segments, {args.pairs * args.interval:.0f} s of recorded traffic\n')
+
+        log = TelemetryLog(session)
+        summary = log.summary()
+        middle = (summary['first'] + summary['last']) / 2
+        window = (middle, middle + args.window)
+        serials = [summary['robots'][0]['serial']]
+        results = {}
+        print(f'{"query":<30}{"rows":>7}{"ms":>10}{"speedup":>9}')
+        for kind in ('gps', 'battery', 'hit'):
+            scan, expected = best(lambda: full_scan(session, kind, *window, set(serials)), repeat=1)
+            indexed, columns = best(lambda: log.query(kind, *window, serials))
+            same = expected.keys() == columns.keys() and \
+                all(np.array_equal(expected[name], columns[name]) for name in expected)
+            mismatches += not same
+            results[kind] = columns
+            rows = len(columns['time'])
+            print(f'{kind + " full scan":<30}{len(expected["time"]):>7}{scan * 1e3:>10.1f}')
+            print(f'{kind + " indexed":<30}{rows:>7}{indexed * 1e3:>10.1f}{scan / indexed:>8.0f}x'
+                  f'{"" if same else "  MISMATCH"}')
+        scan, everything = best(lambda: log.query('gps'), repeat=1)
+        print(f'{"gps, everything":<30}{len(everything["time"]):>7}{scan * 1e3:>10.1f}')
+
+        print(f'\n{"rebuild":<30}{"segments":>9}{"s":>8}')
+        for workers in (1, args.workers):
+            start = time.perf_counter()
+            built = build_indexes(session, workers, force=True)
+            print(f'{f"{workers} worker(s)":<30}{len(built):>9}{time.perf_counter() - start:>8.2f}')
+        rebuilt = TelemetryLog(session).query('gps', *window, serials)
+        mismatches += not all(np.array_equal(rebuilt[name], results['gps'][name]) for name in rebuilt)
+    print(f'\n{mismatches} mismatches')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Microbenchmark for PacketBuilder: encode cost per drive command and per scenario.
+
+Compares the precompiled struct path in HTT.PacketBuilder, and its positional
+drive() used by Htt.cmd_drive, with the byte-by-byte encoder it replaced
+(kept below as legacy_get / legacy_waypointer).
+
+    python benchmarks/bench_packets.py [-n 200000]
+"""
+
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HTT import PacketBuilder
+
+
+def legacy_get(data='request', cycle=1, serial=1201, jx=0, jy=0, jz=0, jb=0):
+    headers = PacketBuilder.headers
+    paylen = 2 if data != 'joy' else 6
+    packet_ = bytearray(4 + paylen)
+    packet_[0] = headers['usb']
+    packet_[1] = paylen
+    packet_[2] = ((serial >> 0) & 0xF)
+    packet_[3] = ((serial >> 4) & 0xF)
+    packet_[4] = headers[data]
+    packet_[5] = cycle
+    if data == 'joy':
+        packet_[6] = (jx + 100)
+        packet_[7] = (jy + 100)
+        packet_[8] = (jz + 100)
+        packet_[9] = jb
+    return packet_
+
+
+def legacy_waypointer(name, date, time, origin, waypoints, serial=1204):
+    headers = PacketBuilder.headers
+    packets = []
+    padded_name = name.encode("utf-8").ljust(12, b'\x00')
+
+    def base_packet(idx, data_bytes):
+        paylen = 1 + 2 + len(data_bytes)
+        p = bytearray(4 + paylen)
+        p[0] = headers['usb']
+        p[1] = paylen
+        p[2] = ((serial >> 0) & 0xF)
+        p[3] = ((serial >> 4) & 0xF)
+        p[4] = headers['upload_scen']
+        p[5] = len(waypoints) + 9
+        p[6] = len(waypoints) + 8
+        p[7] = idx
+        p[8:] = data_bytes
+        return p
+
+    packets.append(base_packet(0, padded_name[:6]))
+    packets.append(base_packet(1, padded_name[6:12]))
+    packets.append(base_packet(2, struct.pack('<I', date) + struct.pack('<I', time)))
+    packets.append(base_packet(3, struct.pack('<f', origin[0])))
+    packets.append(base_packet(4, b'\x00' * 8))
+    packets.append(base_packet(5, struct.pack('<f', origin[1])))
+    packets.append(base_packet(6, b'\x00' * 8))
+    packets.append(base_packet(7, struct.pack('<f', origin[2]) + struct.pack('<f', origin[3])))
+    packets.append(base_packet(8, struct.pack('<H', len(waypoints)) + struct.pack('<H', 0)))
+    for i, (x, y, flag) in enumerate(waypoints):
+        payload = struct.pack('<f', x) + struct.pack('<f', y) + struct.pack('<f', flag)
+        packets.append(base_packet(9 + i, payload))
+    return packets
+
+
+def report(label, seconds, n):
+    print(f'{label:<28}{seconds / n * 1e9:10.0f} ns/op')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', type=int, default=200000, help='encodes per measurement')
+    args = parser.parse_args()
+
+    pb = PacketBuilder()
+    drive = dict(cycle=7, serial=1204, jx=-27, jy=42, jz=0)
+    assert bytes(legacy_get('joy', **drive)) == pb.get('joy', **drive) == pb.drive(1204, 7, -27, 42, 0)
+
+    n = args.n
+    old = min(timeit.repeat(lambda: legacy_get('joy', **drive), number=n, repeat=5))
+    new = min(timeit.repeat(lambda: pb.get('joy', **drive), number=n, repeat=5))
+    fast = min(timeit.repeat(lambda: pb.drive(1204, 7, -27, 42, 0), number=n, repeat=5))
+    report('drive, legacy', old, n)
+    report('drive, struct', new, n)
+    report('drive, PacketBuilder.drive', fast, n)
+    print(f'{"speed-up, struct":<28}{old / new:10.2f} x')
+    print(f'{"speed-up, drive":<28}{old / fast:10.2f} x')
+
+    scenario = ('Trent', 250401, 130701, (36.78, 13.46, 362624.9, 4071544.9),
+                [(362624.9 + i, 4071544.9 + i, 1) for i in range(50)])
+    assert [bytes(p) for p in legacy_waypointer(*scenario)] == pb.waypointer(*scenario)
+    m = max(1, n // 100)
+    old = min(timeit.repeat(lambda: legacy_waypointer(*scenario), number=m, repeat=5))
+    new = min(timeit.repeat(lambda: pb.waypointer(*scenario), number=m, repeat=5))
+    report('50 waypoints, legacy', old, m)
+    report('50 waypoints, struct', new, m)
+    print(f'{"speed-up":<28}{old / new:10.2f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Round-trip fuzz and benchmark for the codecs generated from protocol.json.
+
+Every request and response of every transport is packed from random field
+values, decoded again and compared, then timed. USB responses are also run
+through Decoders.decode_many and checked row by row against the single decoder.
+
+    python benchmarks/bench_protocol.py [--rounds 2000] [-n 100000] [--seed 1]
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+
+RANGES = {'B': (0, 0xFF), 'b': (-0x80, 0x7F), 'H': (0, 0xFFFF), 'h': (-0x8000, 0x7FFF),
+          'I': (0, 0xFFFFFFFF), 'i': (-0x80000000, 0x7FFFFFFF)}
+
+
+def random_values(codec, rng):
+    values, expected = [], {}
+    for field, code in codec.layout:
+        count, kind = int(code[:-1] or 1), code[-1]
+        if kind == 'x':
+            continue
+        if kind == 's':
+            value = bytes(rng.randrange(256) for _ in range(count))
+            values.append(value)
+            expected[field] = value
+            continue
+        if kind == 'f':
+            #Round through float32 so the comparison is exact
+            items = [struct.unpack('<f', struct.pack('<f', rng.uniform(-1e6, 1e6)))[0] for _ in range(count)]
+        else:
+            items = [rng.randint(*RANGES[kind]) for _ in range(count)]
+        values.extend(items)
+        expected[field] = items[0] if count == 1 else items
+    for field, (convert, _) in codec.convert.items():
+        expected[field] = convert(expected[field])
+    return values, expected
+
+
+def fuzz(codecs, rounds, rng):
+    failures = 0
+    for codec in codecs:
+        for _ in range(rounds):
+            values, expected = random_values(codec, rng)
+            packet = codec.pack(*values)
+            if codec.rest:
+                tail = bytes(rng.randrange(256) for _ in range(rng.randrange(16)))
+                packet += tail
+                expected[codec.rest] = tail
+            decoded = codec.decode(packet)
+            if decoded != expected or list(decoded) != list(expected):
+                failures += 1
+                print(f'MISMATCH {codec.name}: {expected} != {decoded}')
+                break
+    return failures
+
+
+def fuzz_columns(rounds, rng):
+    from HTT import Decoders
+    dc = Decoders()
+    failures = 0
+    for key, codec in protocol.USB.responses.items():
+        frames = []
+        for _ in range(rounds):
+            values, _ = random_values(codec, rng)
+            frame = bytearray(codec.pack(*values))
+            frame[0], frame[1] = 0x0D, codec.size - 4
+            frames.append(bytes(frame))
+        columns = dc.decode_many(key, frames)
+        for i, frame in enumerate(frames):
+            row = codec.decode(frame)
+            for field in codec.names:
+                column = columns[field][i]
+                value = column.tolist() if hasattr(column, 'tolist') else column
+                if field in codec.convert and field not in codec.columns:
+                    value = codec.convert[field][0](value)
+                if value != row[field]:
+                    failures += 1
+                    print(f'COLUMN MISMATCH {key}.{field}: {value} != {row[field]}')
+                    break
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rounds', type=int, default=2000, help='random packets per codec')
+    parser.add_argument('-n', type=int, default=100000, help='packs and decodes per timing')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    codecs = [codec for p in protocol.PROTOCOLS.values() for codec in p.codecs()]
+    failures = fuzz(codecs, args.rounds, rng) + fuzz_columns(max(1, args.rounds // 10), rng)
+    print(f'{len(codecs)} codecs, {args.rounds} random packets each, {failures} failures\n')
+
+    print(f'{"codec":<28}{"bytes":>6}{"pack ns":>10}{"decode ns":>11}')
+    for codec in codecs:
+        values, _ = random_values(codec, rng)
+        packet = codec.pack(*values) + (b'path\x00' if codec.rest else b'')
+        pack = min(timeit.repeat(lambda: codec.pack(*values), number=args.n, repeat=3))
+        decode = min(timeit.repeat(lambda: codec.decode(packet), number=args.n, repeat=3))
+        print(f'{codec.name:<28}{codec.size:>6}{pack / args.n * 1e9:>10.0f}{decode / args.n * 1e9:>11.0f}')
+
+    with tempfile.TemporaryDirectory() as cache:
+        start = time.perf_counter()
+        protocol.load(cache=cache)
+        cold = time.perf_counter() - start
+        warm = min(timeit.repeat(lambda: protocol.load(cache=cache), number=1, repeat=20))
+    print(f'\nschema load: {cold * 1e3:.2f} ms generated, {warm * 1e3:.2f} ms from cache')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
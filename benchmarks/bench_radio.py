@@ -0,0 +1,98 @@
+"""
+Throughput and latency of Htt against the emulated USB radio (usb_emulator.py).
+
+Polls gps from every robot at several RadioStack windows, then uploads a
+scenario with packet loss, all on a pseudo-terminal so no hardware is needed.
+
+    python benchmarks/bench_radio.py [--robots 8] [--latency 0.03] [--jitter 0.01] [--seconds 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HTT import Htt
+from usb_emulator import UsbRadioEmulator
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def connect(emulator, **kwargs):
+    htt = Htt(port=emulator.port, **kwargs)
+    htt.radio.online.wait(5)
+    return htt
+
+
+def poll(emulator, window, seconds):
+    #One client thread per robot, each asks its robot for gps as fast as answers come back
+    htt = connect(emulator, window=window)
+    serials = [robot.serial for robot in emulator.robots.values()]
+    times, errors = [], [0]
+    stop = time.monotonic() + seconds
+
+    def client(serial):
+        while time.monotonic() < stop:
+            start = time.monotonic()
+            try:
+                if htt.info_gps(serial)['serial'] == serial:
+                    times.append(time.monotonic() - start)
+                else:
+                    errors[0] += 1
+            except Exception:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(serial,)) for serial in serials]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    htt.radio.close()
+    return len(times) / seconds, percentile(times, 0.5), percentile(times, 0.99), errors[0]
+
+
+def upload(emulator, window, waypoints, upload_dir):
+    htt = connect(emulator, upload_dir=upload_dir)
+    start = time.monotonic()
+    done = htt.cmd_upload('bench', 250401, 130701, (36.78, 13.46, 362624.9, 4071544.9),
+                          waypoints, serial=1204, window=window)
+    elapsed = time.monotonic() - start
+    htt.radio.close()
+    return done, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--robots', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.03, help='seconds per robot answer')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--seconds', type=float, default=3.0, help='length of each poll run')
+    parser.add_argument('--waypoints', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f'{args.robots} robots, latency {args.latency * 1e3:.0f} ms + {args.jitter * 1e3:.0f} ms jitter\n')
+    print(f'{"gps poll":<16}{"polls/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for window in (1, 4, args.robots):
+        with UsbRadioEmulator(args.robots, latency=args.latency, jitter=args.jitter, seed=1) as emulator:
+            rate, p50, p99, errors = poll(emulator, window, args.seconds)
+        print(f'{"window " + str(window):<16}{rate:>10.1f}{p50 * 1e3:>10.1f}{p99 * 1e3:>10.1f}{errors:>8}')
+
+    waypoints = [(362624.9 + i, 4071544.9 + (i * 7) % 11, 1) for i in range(args.waypoints)]
+    print(f'\n{"upload":<16}{"loss":>10}{"seconds":>10}{"done":>8}')
+    for loss in (0.0, 0.1, 0.2):
+        for window in (1, 4, 8):
+            with tempfile.TemporaryDirectory() as upload_dir, \
+                    UsbRadioEmulator(args.robots, latency=args.latency, jitter=args.jitter, loss=loss, seed=2) as emulator:
+                done, elapsed = upload(emulator, window, waypoints, upload_dir)
+            print(f'{"window " + str(window):<16}{loss:>10.0%}{elapsed:>10.2f}{str(done):>8}')
+
+
+if __name__ == '__main__':
+    main()
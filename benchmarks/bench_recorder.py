@@ -0,0 +1,97 @@
+"""
+Cost of the flight recorder (recorder.py) on the radio threads and on disk.
+
+Times FlightRecorder.record() as the radio threads call it, how fast the
+background thread writes segments, the bytes per frame against JSON lines,
+and how fast a recording reads back. Every frame read back is checked.
+
+    python benchmarks/bench_recorder.py [-n 200000] [--threads 2] [--segment-mb 4]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recorder import RX, TX, FlightRecorder, read_recording
+
+
+def frames(n, rng):
+    #gps requests and answers for eight robots, the bulk of live traffic
+    out = []
+    for i in range(n):
+        serial = 1201 + i % 8
+        if i % 2:
+            out.append((RX, bytes([0x0D, 16, serial & 0xFF, serial >> 8]) + bytes(rng.randrange(256) for _ in range(16))))
+        else:
+            out.append((TX, bytes([0x0D, 2, serial & 0xF, (serial >> 4) & 0xF, 1, 0])))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', type=int, default=200000, help='frames to record')
+    parser.add_argument('--threads', type=int, default=2, help='threads calling record() at once')
+    parser.add_argument('--segment-mb', type=float, default=4)
+    args = parser.parse_args()
+    rng = random.Random(1)
+    traffic = frames(args.n, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        calls = 100000
+        recorder = FlightRecorder(directory, segment_size=int(args.segment_mb * (1 << 20)),
+                                  max_pending=3 * calls + args.n).start()
+        direction, frame = traffic[1]
+        cost = min(timeit.repeat(lambda: recorder.record(direction, '/dev/ttyUSB0', frame), number=calls, repeat=3))
+        recorder.flush(60)
+
+        share = [traffic[i::args.threads] for i in range(args.threads)]
+
+        def radio(part):
+            for direction, frame in part:
+                recorder.record(direction, '/dev/ttyUSB0', frame)
+
+        threads = [threading.Thread(target=radio, args=(part,)) for part in share]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queued = time.perf_counter() - start
+        recorder.flush(60)
+        written = time.perf_counter() - start
+        recorder.close()
+        stats = recorder.stats()
+
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+        start = time.perf_counter()
+        records = list(read_recording(directory))[3 * calls:]
+        read = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lines = [json.dumps({'t': time.monotonic(), 'dir': d, 'port': '/dev/ttyUSB0', 'frame': f.hex()}) for d, f in traffic]
+    as_json = time.perf_counter() - start
+    json_size = sum(len(line) + 1 for line in lines)
+
+    #Threads interleave, so compare the frames rather than their order
+    mismatches = 0 if sorted(r.frame for r in records) == sorted(f for _, f in traffic) else 1
+
+    print(f'record() on the radio thread: {cost / calls * 1e9:.0f} ns per frame')
+    print(f'{args.n} frames from {args.threads} threads: queued in {queued:.2f} s, '
+          f'written in {written:.2f} s ({args.n / written:,.0f} frames/s), {stats["segments"]} segments')
+    print(f'on disk {size / (3 * calls + args.n):.1f} bytes/frame, JSON lines {json_size / args.n:.1f} bytes/frame '
+          f'({as_json / args.n * 1e9:.0f} ns/frame to format)')
+    print(f'read back {len(records)} frames at {(3 * calls + args.n) / read:,.0f} frames/s, '
+          f'dropped {stats["dropped"]}, {mismatches} mismatches')
+    return 1 if mismatches or len(records) != args.n else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Throughput of the telemetry pipeline, replaying a recorded session (replay.py).
+
+Writes a synthetic flight recorder session of USB polls and CL4790 TDMA
+traffic, then replays it as fast as possible through each stage: reading
+the segments, Decoders, the TelemetryCache and Fleet the Flask app serves
+from, and HTTRadioController._process_received_packet. A short slice is
+also replayed at 1x and 10x to check the pacing.
+
+    python benchmarks/bench_replay.py [--pairs 50000] [--robots 8] [--interval 0.02]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cl4790_emulator import EmulatedClient
+from fleet import Fleet
+from HTT import PacketBuilder
+from protocol import CL4790
+from recorder import RX, TX, FlightRecorder, read_recording
+from replay import Replayer, load_controller
+from telemetry import TelemetryCache
+from usb_emulator import EmulatedRobot
+
+#Request mix of the telemetry poller plus the drives in between
+KINDS = ('gps', 'joy', 'gps', 'system', 'joy', 'gps', 'hit', 'joy', 'bat1')
+
+
+def synthesize(directory, pairs, robots, interval, **options):
+    #Request/answer pairs spaced interval apart, USB robots and CL4790 clients taking turns.
+    #options go to the FlightRecorder, e.g. segment_size or index
+    rng = random.Random(1)
+    pb = PacketBuilder()
+    usb = [EmulatedRobot(1201 + i, i + 1, rng=rng) for i in range(robots)]
+    cl4790 = [EmulatedClient(i + 1, bytes([0x78, 0x9A, i + 1]), rng) for i in range(robots)]
+    recorder = FlightRecorder(directory, max_pending=4 * pairs + 10, **options).start()
+    mono = time.monotonic_ns()
+    step = int(interval * 1e9)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(pairs):
+            mono += step
+            if i % 2:
+                robot = usb[(i // 2) % robots]
+                packet = pb.get(KINDS[(i // 2) % len(KINDS)], serial=robot.serial, jx=i % 50, jy=-(i % 30))
+                recorder.record(TX, '/dev/ttyUSB0', packet, mono=mono)
+                recorder.record(RX, '/dev/ttyUSB0', robot.handle(packet), mono=mono + step // 2)
+            else:
+                client = cl4790[(i // 2) % robots]
+                payload = CL4790.requests['rc'].pack(client.id, client.id % robots + 1, i & 0xFFFF, 1, 2, 1, 3, 10, 20, 0, 0)
+                recorder.record(TX, 'COM9', payload, protocol='cl4790', mono=mono)
+                kind = ('diag', 'status', 'pathname')[(i // 2) % 3]
+                recorder.record(RX, 'COM9', client.answer(kind), protocol='cl4790', mono=mono + step // 2)
+    recorder.close()
+    return recorder.stats()
+
+
+def timed(label, replayer, records=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = replayer.run(records)
+    late = f'{stats["max_late"] * 1e3:.1f}' if replayer.speed else ''
+    print(f'{label:<34}{stats["records"]:>9}{stats["seconds"]:>9.2f}{stats["records_per_s"]:>14,.0f}{late:>10}')
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pairs', type=int, default=50000, help='request/answer pairs to record')
+    parser.add_argument('--robots', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between recorded requests')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        written = synthesize(directory, args.pairs, args.robots, args.interval)
+        print(f'{written["records"]} frames, {args.pairs * args.interval:.0f} s of recorded traffic, '
+              f'{written["segments"]} segments\n')
+        print(f'{"stage":<34}{"records":>9}{"seconds":>9}{"records/s":>14}{"late ms":>10}')
+
+        start = time.monotonic()
+        records = list(read_recording(directory))
+        read = time.monotonic() - start
+        print(f'{"read segments":<34}{len(records):>9}{read:>9.2f}{len(records) / read:>14,.0f}{"":>10}')
+        timed('decode', Replayer(directory, speed=0), records)
+        cache, fleet = TelemetryCache(), Fleet(())
+        stats = timed('decode + cache + fleet', Replayer(directory, speed=0, cache=cache, fleet=fleet), records)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                controller = load_controller(args.robots)
+        except ImportError as e:
+            print(f'{"CL4790 controller":<34}skipped, {e}')
+        else:
+            stats = timed('decode + cache + CL4790 controller',
+                          Replayer(directory, speed=0, cache=cache, fleet=fleet, controller=controller), records)
+            print(f'{"":<34}CL4790 clients heard: {sum(c.msg_recv for c in controller.clients)}')
+
+        head = [r for r in records if r.wall - records[0].wall < 2.0]
+        for speed in (1.0, 10.0):
+            timed(f'first 2 s at {speed:g}x', Replayer(directory, speed=speed), head)
+
+        print(f'\nfleet {fleet.serials()}, unmatched {stats.get("unmatched", 0)}, errors {stats.get("errors", 0)}')
+    return 1 if stats.get('errors') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
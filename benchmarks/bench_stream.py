@@ -0,0 +1,107 @@
+"""
+Fan-out cost and delivery latency of the telemetry stream (telemetry.TelemetryStream).
+
+One producer publishes gps, battery and system updates for a fleet the way
+the TelemetryPoller does, while subscriber threads drain their queues like
+the /_telemetry/stream route. Reports the cost of publish() on the radio
+thread, the time from publish to a subscriber holding the update, and what
+a deliberately slow subscriber loses to its bounded queue. For comparison,
+polling /_gps/info every 5 s shows a position 2.5 s old on average.
+
+    python benchmarks/bench_stream.py [--subscribers 1 10 50] [--rate 200] [--seconds 3]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telemetry import TelemetryCache, TelemetryStream
+
+FIELDS = ('gps', 'battery', 'system')
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float('nan')
+
+
+def subscriber(stream, delays, stop, pause):
+    subscription = stream.subscribe(fields=FIELDS)
+    while not stop.is_set():
+        event = subscription.get(0.1)
+        if event is None:
+            continue
+        delays.append(time.perf_counter() - event[3]['sent'])
+        if pause:
+            time.sleep(pause)
+    stream.unsubscribe(subscription)
+
+
+def run(subscribers, rate, seconds, robots, slow):
+    stream = TelemetryStream()
+    cache = TelemetryCache(stream=stream)
+    stop = threading.Event()
+    delays = [[] for _ in range(subscribers + slow)]
+    threads = [threading.Thread(target=subscriber, args=(stream, delays[i], stop, 0.05 if i >= subscribers else 0))
+               for i in range(subscribers + slow)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    costs = []
+    interval = 1 / rate
+    due = time.perf_counter()
+    end = due + seconds
+    n = 0
+    while time.perf_counter() < end:
+        serial, field = 1201 + n % robots, FIELDS[n % len(FIELDS)]
+        start = time.perf_counter()
+        cache.update(serial, field, {'serial': serial, 'sent': start})
+        costs.append(time.perf_counter() - start)
+        n += 1
+        due += interval
+        time.sleep(max(0, due - time.perf_counter()))
+    time.sleep(0.2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    fast = [d for part in delays[:subscribers] for d in part]
+    stats = stream.stats()
+    return {
+        'subscribers': subscribers,
+        'published': n,
+        'delivered': len(fast),
+        'publish_us': 1e6 * sum(costs) / len(costs),
+        'p50_ms': 1e3 * percentile(fast, 0.5),
+        'p99_ms': 1e3 * percentile(fast, 0.99),
+        'slow_delivered': sum(len(part) for part in delays[subscribers:]),
+        'dropped': stats['dropped'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--rate', type=float, default=200.0, help='updates published per second')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--robots', type=int, default=8)
+    parser.add_argument('--slow', type=int, default=1, help='subscribers that take 50 ms per update')
+    args = parser.parse_args()
+
+    print(f'{"subscribers":>12}{"published":>11}{"delivered":>11}{"publish us":>12}{"p50 ms":>9}{"p99 ms":>9}'
+          f'{"slow got":>10}{"dropped":>9}')
+    for subscribers in args.subscribers:
+        r = run(subscribers, args.rate, args.seconds, args.robots, args.slow)
+        print(f'{subscribers:>12}{r["published"]:>11}{r["delivered"]:>11}{r["publish_us"]:>12.1f}'
+              f'{r["p50_ms"]:>9.2f}{r["p99_ms"]:>9.2f}{r["slow_delivered"]:>10}{r["dropped"]:>9}')
+        if r['delivered'] < r['published'] * subscribers:
+            print(f'{"":>12}a fast subscriber missed {r["published"] * subscribers - r["delivered"]} updates')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import argparse
+import time
+
+from protocol import CL4790
+from ptyradio import PtyRadio
+
+
+#API mode frame headers, host to radio and radio to host
+API_SEND = 0x81
+API_RECEIVE = 0x81
+BROADCAST = b'\xff\xff\xff'
+
+
+class EmulatedClient:
+    #One HTT robot on the CL4790 network, it answers when the controller names it as respClient
+    def __init__(self,client_id,mac,rng):
+        self.id = client_id
+        self.mac = mac
+        self.state = 2
+        self.errors = 0
+        self.utm_x = 3626249 + rng.randint(-500,500)
+        self.utm_y = 40715449 + rng.randint(-500,500)
+        self.bvolt = [2520,2515]
+        self.pathname = f'scen{client_id:02d}'
+        self.joystick = (0,0,0,0)
+        self.counts = {'heard':0,'asked':0,'answered':0}
+
+    def hear(self,header,payload):
+        #Only the addressed client acts on the joystick part of an RC packet
+        if header['ptype'] == CL4790.types['CONTROLLER_INPUT']:
+            rc = CL4790.requests['rc'].decode(payload)
+            self.joystick = (rc['joy_x'],rc['joy_y'],rc['joy_z'],rc['btns'])
+            self.utm_x += rc['joy_x'] // 10
+            self.utm_y += rc['joy_y'] // 10
+        self.counts['heard'] += 1
+
+    def answer(self,kind):
+        self.counts['answered'] += 1
+        ptype = CL4790.types[f'RESPONSE_PACK_{kind.upper()}']
+        codec = CL4790.responses[kind]
+        if kind == 'diag':
+            payload = codec.pack(self.id,ptype,self.state,self.errors,self.utm_x,self.utm_y,*self.bvolt)
+        elif kind == 'status':
+            speed = int((self.joystick[0]**2 + self.joystick[1]**2) ** 0.5)
+            payload = codec.pack(self.id,ptype,self.state,self.errors,speed,0,12,3,11,3)
+        else:
+            payload = codec.pack(self.id,ptype,self.state,self.errors) + self.pathname.encode().ljust(8,b'\x00')
+        #Short layouts are padded up to what the controller accepts
+        return payload.ljust(codec.min_size,b'\x00')
+
+
+class CL4790Emulator(PtyRadio):
+    #Pseudo-terminal CL4790 in API mode with HTT clients behind it.
+    #Every client hears every RC packet on the shared channel, the addressed one (by MAC) takes the
+    #joystick and the one named respClient answers in the same slot, cycling diag, status and pathname
+    def __init__(self,clients=8,macs=None,latency=0.01,jitter=0.0,loss=0.0,rssi=(60,110),
+                 responses=('diag','status','pathname'),seed=None):
+        super().__init__(latency,jitter,loss,seed)
+        #Same MACs HTTRadioController gives its clients, only the last 3 bytes go on the air
+        macs = macs or [f'12:34:56:78:9A:{i+1:02X}' for i in range(clients)]
+        self.clients = {}
+        for i,mac in enumerate(macs):
+            address = bytes(int(x,16) for x in mac.split(':')[-3:])
+            self.clients[address] = EmulatedClient(i+1,address,self.rng)
+        self.by_id = {client.id:client for client in self.clients.values()}
+        self.rssi = rssi
+        self.responses = responses
+
+    def frames(self,buf):
+        #0x81, length, session, retries, MAC[3], payload
+        while len(buf) >= 7:
+            if buf[0] != API_SEND:
+                idx = buf.find(bytes([API_SEND]),1)
+                del buf[:idx if idx > 0 else len(buf)]
+                self.counters['garbage'] += 1
+                continue
+            length = 7 + buf[1]
+            if len(buf) < length:
+                return
+            packet = bytes(buf[:length])
+            del buf[:length]
+            yield packet
+
+    def receive(self,packet):
+        address,payload = packet[4:7],packet[7:]
+        if len(payload) < CL4790.requests['header'].size:
+            self.counters['garbage'] += 1
+            return
+        header = CL4790.requests['header'].decode(payload)
+        target = self.clients.get(address)
+        if target is None and address != BROADCAST:
+            self.counters['unknown'] += 1
+            return
+        if self.lost():
+            return
+        for client in ([target] if target else self.clients.values()):
+            client.hear(header,payload)
+        responder = self.by_id.get(header['respClient'])
+        if responder is None:
+            return
+        responder.counts['asked'] += 1
+        kind = self.responses[responder.counts['asked'] % len(self.responses)]
+        response = responder.answer(kind)
+        if self.lost():
+            return
+        rssi = self.rng.randint(*self.rssi)
+        #0x81, length, RSSI, RSSI*, source MAC[3], payload
+        self.send(bytes([API_RECEIVE,len(response),rssi,max(0,rssi-self.rng.randint(0,6))]) + responder.mac + response)
+
+    def stats(self):
+        return {'port':self.port,
+                **self.counters,
+                'clients':{client.id:dict(client.counts) for client in self.clients.values()},
+                }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulated CL4790 radio in API mode with HTT clients, on a pseudo-terminal')
+    parser.add_argument('--clients',type=int,default=8)
+    parser.add_argument('--latency',type=float,default=0.01,help='seconds until a client answers')
+    parser.add_argument('--jitter',type=float,default=0.0,help='up to this many more seconds')
+    parser.add_argument('--loss',type=float,default=0.0,help='chance a packet or its answer is lost')
+    parser.add_argument('--seed',type=int)
+    args = parser.parse_args()
+    emulator = CL4790Emulator(args.clients,latency=args.latency,jitter=args.jitter,loss=args.loss,seed=args.seed)
+    print(f'Emulated CL4790 on {emulator.start()}, {len(emulator.clients)} clients')
+    try:
+        while True:
+            time.sleep(10)
+            print(emulator.stats())
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import threading
+
+
+class Fleet:
+    def __init__(self,serials=(1204,)):
+        #Robot serial -> display name, shared by the web routes and the telemetry poller
+        self.robots = {}
+        self.lock = threading.Lock()
+        for serial in serials:
+            self.add(serial)
+        self.active = serials[0] if serials else None
+
+    def add(self,serial,name=None):
+        with self.lock:
+            self.robots[serial] = name or f'HTT {serial}'
+            if getattr(self,'active',None) is None:
+                self.active = serial
+
+    def remove(self,serial):
+        with self.lock:
+            self.robots.pop(serial,None)
+            if self.active == serial:
+                self.active = min(self.robots) if self.robots else None
+
+    def select(self,serial):
+        with self.lock:
+            if serial not in self.robots:
+                raise KeyError(f'Robot {serial} is not in the fleet')
+            self.active = serial
+
+    def serials(self):
+        with self.lock:
+            return sorted(self.robots)
+
+    def name(self,serial):
+        with self.lock:
+            return self.robots.get(serial)
+
+    def __contains__(self,serial):
+        with self.lock:
+            return serial in self.robots
+
+    def __len__(self):
+        with self.lock:
+            return len(self.robots)
@@ -0,0 +1,110 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+import time
+
+
+#inotify flags for device nodes appearing and disappearing in /dev
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ATTRIB = 0x004
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _inotify(path):
+    #File descriptor watching path, or None where inotify is missing (Windows, macOS)
+    name = ctypes.util.find_library('c')
+    try:
+        libc = ctypes.CDLL(name,use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError,AttributeError,TypeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd,path.encode(),IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class PortWatcher:
+    #Calls every subscriber with (added, removed) port names when USB radios come and go
+    def __init__(self,scan,interval=2.0,path='/dev'):
+        #scan returns the current port names, e.g. HTT.usbPorts
+        self.scan = scan
+        self.interval = interval
+        self.path = path
+        self.ports = set()
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.fd = None
+
+    def subscribe(self,fn):
+        with self.lock:
+            self.subscribers.append(fn)
+
+    def start(self):
+        if self.running:
+            return self
+        self.ports = set(self._scan())
+        self.fd = _inotify(self.path) if os.path.isdir(self.path) else None
+        self.running = True
+        self.thread = threading.Thread(target=self._watch_task,daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _scan(self):
+        try:
+            return self.scan()
+        except Exception as e:
+            print(f'Port scan failed: {e}')
+            return list(self.ports)
+
+    def _wait(self):
+        #True once /dev changed, udev renames and permission fixes arrive as more events
+        if self.fd is None:
+            return False
+        ready,_,_ = select.select([self.fd],[],[],self.interval)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd,4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def _watch_task(self):
+        while self.running:
+            if self.fd is None:
+                #No inotify, fall back to enumerating the ports every interval
+                time.sleep(self.interval)
+            elif self._wait():
+                #Let udev finish creating the node before enumerating
+                time.sleep(0.2)
+            self.check()
+
+    def check(self):
+        ports = set(self._scan())
+        added,removed = ports - self.ports,self.ports - ports
+        self.ports = ports
+        if not added and not removed:
+            return
+        print(f'USB radios changed, added {sorted(added)} removed {sorted(removed)}')
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for fn in subscribers:
+            fn(added,removed)
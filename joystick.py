@@ -0,0 +1,185 @@
+import json
+import math
+import struct
+import threading
+import time
+
+from HTT import RadioUnavailable
+from metrics import REGISTRY
+
+
+#Binary stick update: sequence, client time (ms), power 0..1, angle in radians, robot serial (0 for the fleet's active robot)
+FRAME = struct.Struct('<IdffH')
+#Binary ack: sequence, client time echoed back, server stamp (ms), last round trip measured by the server (ms, NaN before the first)
+ACK = struct.Struct('<Iddd')
+#Binary pong: the server stamp of an ack, sent back by the client as soon as the ack arrives
+PONG = struct.Struct('<d')
+
+
+class JoystickChannel:
+    #One persistent control connection. Decodes stick updates, hands them to drive and answers each with an ack.
+    #JSON text updates {"seq","t","POWER","ANGLE","SERIAL"} are acked in JSON, FRAME updates with an ACK.
+    #The client times its round trip from the echoed t. It answers every ack at once with a pong, {"pong":st} or a
+    #PONG frame, and the server times its own round trip from that, so the operator's pauses never count
+    def __init__(self,drive,metrics=REGISTRY):
+        #drive(power, angle, serial), serial None for the active robot
+        self.drive = drive
+        self.metrics = metrics
+        self.rtt = None
+        self.counters = {'updates':0,'errors':0}
+
+    @staticmethod
+    def stamp():
+        return time.monotonic()*1000
+
+    @staticmethod
+    def parse(message):
+        #('pong', server stamp) of a pong, or ('update', (seq, client time, power, angle, serial)) of one update
+        if isinstance(message,(bytes,bytearray)):
+            if len(message) == PONG.size:
+                return 'pong',PONG.unpack(message)[0]
+            seq,t,power,angle,serial = FRAME.unpack(message)
+            return 'update',(seq,t,power,angle,serial or None)
+        data = json.loads(message)
+        if 'pong' in data:
+            return 'pong',float(data['pong'])
+        serial = data.get('SERIAL')
+        return 'update',(int(data.get('seq',0)),float(data.get('t',0)),
+                         float(data.get('POWER',0)),float(data.get('ANGLE',0)),None if serial is None else int(serial))
+
+    def handle(self,message):
+        #The ack to send back for message, None for a pong which is not answered
+        received = self.stamp()
+        try:
+            kind,value = self.parse(message)
+        except (ValueError,TypeError,AttributeError,struct.error) as e:
+            self.counters['errors'] += 1
+            return json.dumps({'error':f'bad update: {e}'})
+        if kind == 'pong':
+            self.rtt = received - value
+            self.metrics.observe('joystick_rtt_seconds',self.rtt/1000)
+            return None
+        seq,t,power,angle,serial = value
+        self.counters['updates'] += 1
+        error = None
+        try:
+            self.drive(power,angle,serial)
+        except RadioUnavailable as e:
+            error = f'radio unavailable: {e}'
+        except Exception as e:
+            self.counters['errors'] += 1
+            error = str(e)
+        if isinstance(message,(bytes,bytearray)) and error is None:
+            return ACK.pack(seq,t,self.stamp(),math.nan if self.rtt is None else self.rtt)
+        ack = {'ack':seq,'t':t,'st':self.stamp(),'rtt':self.rtt}
+        if error is not None:
+            ack['error'] = error
+        return json.dumps(ack)
+
+
+class TokenBucket:
+    #rate tokens a second up to burst, one per command sent on
+    def __init__(self,rate,burst,now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic() if now is None else now
+
+    def refill(self,now):
+        self.tokens = min(self.burst,self.tokens + (now - self.last)*self.rate)
+        self.last = now
+
+    def take(self,now):
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def due(self,now):
+        #Seconds until the next token
+        self.refill(now)
+        return max(0.0,(1 - self.tokens)/self.rate)
+
+
+class CommandThrottle:
+    #A token bucket per key, e.g. (operator, robot), so operators never throttle each other.
+    #Input over the rate is not refused: it waits in place of whatever was waiting for that key, and the newest
+    #goes out as soon as the bucket allows, so the end of a gesture always reaches the robot
+    def __init__(self,rate=10.0,burst=2,idle=60.0,metrics=REGISTRY):
+        self.rate = rate
+        self.burst = burst
+        #Buckets unused this long are forgotten, a full bucket is the same as a new one
+        self.idle = idle
+        self.metrics = metrics
+        self.buckets = {}
+        #Key -> (func, args) of the newest input waiting for a token
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.counters = {'forwarded':0,'coalesced':0,'discarded':0}
+        self.running = False
+        self.thread = None
+
+    def _count(self,result):
+        self.counters[result] += 1
+        self.metrics.inc('joystick_inputs_total',result=result)
+
+    def submit(self,key,func,*args):
+        #True when func(*args) ran now, False when it waits for a token. Errors of a call made now reach the caller
+        with self.cond:
+            now = time.monotonic()
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate,self.burst,now)
+            if key not in self.pending and bucket.take(now):
+                self._count('forwarded')
+                func(*args)
+                return True
+            if key in self.pending:
+                self._count('coalesced')
+            self.pending[key] = (func,args)
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self._flush_task,daemon=True)
+                self.thread.start()
+            self.cond.notify()
+            return False
+
+    def _flush_task(self):
+        with self.cond:
+            while self.running:
+                now = time.monotonic()
+                wait = self.idle
+                for key,(func,args) in list(self.pending.items()):
+                    bucket = self.buckets[key]
+                    if not bucket.take(now):
+                        wait = min(wait,bucket.due(now))
+                        continue
+                    del self.pending[key]
+                    self._count('forwarded')
+                    try:
+                        func(*args)
+                    except Exception as e:
+                        print(f'Held joystick input for {key} failed: {e}')
+                for key,bucket in list(self.buckets.items()):
+                    if key not in self.pending and now - bucket.last > self.idle:
+                        del self.buckets[key]
+                self.cond.wait(wait)
+
+    def discard(self,serial):
+        #Drops every held input for robot serial, keys are (session, serial), e.g. before a stop
+        with self.cond:
+            for key in [key for key in self.pending if key[1] == serial]:
+                del self.pending[key]
+                self._count('discarded')
+
+    def stats(self):
+        with self.cond:
+            return {**self.counters,'pending':len(self.pending),'keys':len(self.buckets)}
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
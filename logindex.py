@@ -0,0 +1,299 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from HTT import Decoders, ResponseMatcher
+from recorder import HEADER_SIZE, TX, scan_records, segment_header, segment_paths
+
+
+#What the query API calls the response layouts
+KINDS = {'gps':'gps','battery':'bat1','bat1':'bat1','hit':'hit','system':'system'}
+VERSION = 1
+
+
+def index_path(segment):
+    return os.path.splitext(segment)[0] + '.idx'
+
+
+class SegmentIndex:
+    #Sparse time/robot index of one segment: a block per block_seconds or block_records records, whichever comes first.
+    #Each block keeps its time span, byte range, answer counts per robot and type, and the requests still waiting
+    #for an answer when it starts (carry), so a query can start decoding at any block
+    def __init__(self,path,wall,mono,block_seconds=1.0,block_records=1024):
+        self.path = path
+        self.wall = wall
+        self.mono = mono
+        self.block_ns = int(block_seconds*1e9)
+        self.block_records = block_records
+        self.ports = {}
+        self.blocks = []
+        self.block = None
+        self.matcher = ResponseMatcher()
+        #Everything before end is indexed, waiting is the matcher state there
+        self.end = HEADER_SIZE
+        self.saved = None
+
+    def _carry(self):
+        return [[lo,hi,kind] for (lo,hi),kind in self.matcher.waiting.items()]
+
+    def port(self,port_id,protocol,name):
+        self.ports[port_id] = (protocol,name)
+
+    def add(self,offset,end,mono,direction,protocol,serial,frame):
+        block = self.block
+        if block is None or mono - block['t0'] >= self.block_ns or block['records'] >= self.block_records:
+            block = self.block = {'t0':mono,'t1':mono,'start':offset,'end':end,'records':0,
+                                  'carry':self._carry(),'serials':{}}
+            self.blocks.append(block)
+        block['t0'] = min(block['t0'],mono)
+        block['t1'] = max(block['t1'],mono)
+        block['end'] = end
+        block['records'] += 1
+        self.end = end
+        if protocol != 'usb':
+            return
+        if direction == TX:
+            self.matcher.sent(frame)
+            return
+        kind = self.matcher.answered(frame)
+        if kind is not None:
+            counts = block['serials'].setdefault(serial,{})
+            counts[kind] = counts.get(kind,0) + 1
+
+    def save(self):
+        #Written next to the segment and swapped in whole, a reader never sees half an index
+        if self.saved == self.end:
+            return
+        data = {'version':VERSION,
+                'segment':os.path.basename(self.path),
+                'wall':self.wall,
+                'mono':self.mono,
+                'ports':{str(k):list(v) for k,v in self.ports.items()},
+                'end':self.end,
+                'waiting':self._carry(),
+                'blocks':self.blocks,
+                }
+        path = index_path(self.path)
+        with open(path + '.tmp','w') as f:
+            json.dump(data,f,separators=(',',':'))
+        os.replace(path + '.tmp',path)
+        self.saved = self.end
+
+    @classmethod
+    def load(cls,segment):
+        #The saved index of segment, None when there is none or it is from another version
+        try:
+            with open(index_path(segment)) as f:
+                data = json.load(f)
+        except (OSError,ValueError):
+            return None
+        if data.get('version') != VERSION:
+            return None
+        index = cls(segment,data['wall'],data['mono'])
+        index.ports = {int(k):tuple(v) for k,v in data['ports'].items()}
+        index.end = index.saved = data['end']
+        index.matcher = ResponseMatcher({(lo,hi):kind for lo,hi,kind in data['waiting']})
+        for block in data['blocks']:
+            block['serials'] = {int(k):v for k,v in block['serials'].items()}
+        index.blocks = data['blocks']
+        return index
+
+    def span(self):
+        #(first, last) wall clock time of the indexed records
+        if not self.blocks:
+            return None
+        return (self.wall + (min(b['t0'] for b in self.blocks) - self.mono)/1e9,
+                self.wall + (max(b['t1'] for b in self.blocks) - self.mono)/1e9)
+
+
+def _open_segment(path):
+    #Read-only map of a segment, None for one too short to hold its header
+    with open(path,'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+            return None
+        return mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+
+def build_index(path,block_seconds=1.0,block_records=1024):
+    #Indexes one segment from scratch, returns (path, blocks, records)
+    data = _open_segment(path)
+    if data is None:
+        return path,0,0
+    try:
+        header,wall,mono = segment_header(data,path)
+        index = SegmentIndex(path,wall,mono,block_seconds,block_records)
+        ports = index.ports
+        records = 0
+        for offset,end,record in scan_records(data,wall,mono,ports,header):
+            index.add(offset,end,record.mono,record.direction,record.protocol,record.serial,record.frame)
+            records += 1
+        index.save()
+        return path,len(index.blocks),records
+    finally:
+        data.close()
+
+
+def stale(path):
+    #A segment without an index, or written to after its index was saved
+    try:
+        return os.path.getmtime(index_path(path)) < os.path.getmtime(path)
+    except OSError:
+        return True
+
+
+def build_indexes(root='recordings',workers=None,force=False,block_seconds=1.0,block_records=1024):
+    #Rebuilds the missing and stale indexes of every session under root, one segment per worker process
+    paths = [path for path in sorted(glob.glob(os.path.join(root,'**','seg-*.htr'),recursive=True))
+             if force or stale(path)]
+    if not paths:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(build_index,paths,[block_seconds]*len(paths),[block_records]*len(paths)))
+
+
+class TelemetryLog:
+    #Decoded telemetry columns from the recordings under root, read through the segment indexes
+    def __init__(self,root='recordings',decoder=None):
+        self.root = root
+        self.decoder = decoder or Decoders()
+        self.counters = {'blocks':0,'skipped':0,'unindexed':0}
+        #Segment path -> (index file mtime, SegmentIndex), an index is only parsed again once it was saved again
+        self.loaded = {}
+
+    def sessions(self):
+        #root may also be a single session
+        if segment_paths(self.root):
+            return [self.root]
+        return sorted(os.path.dirname(path) for path in glob.glob(os.path.join(self.root,'*','seg-000000.htr')))
+
+    def indexes(self):
+        #Saved index of every segment, a missing one is built on the spot
+        for session in self.sessions():
+            for path in segment_paths(session):
+                try:
+                    mtime = os.path.getmtime(index_path(path))
+                except OSError:
+                    build_index(path)
+                    mtime = None
+                cached = self.loaded.get(path)
+                if cached is not None and cached[0] == mtime:
+                    yield cached[1]
+                    continue
+                index = SegmentIndex.load(path)
+                if index is not None:
+                    self.loaded[path] = (os.path.getmtime(index_path(path)),index)
+                    yield index
+
+    def query(self,kind='gps',start=None,end=None,serials=None):
+        #Columns of every kind answer from the robots in serials between start and end (wall clock seconds),
+        #plus a time column. None means no limit
+        layout = KINDS[kind]
+        size = self.decoder.layouts[layout].size
+        serials = None if serials is None else set(serials)
+        times,frames = [],[]
+        for index in self.indexes():
+            span = index.span()
+            if span is not None and end is not None and span[0] > end:
+                continue
+            #A closed segment is trimmed to its last record, with nothing past its index it can be ruled out by time alone
+            if span is not None and start is not None and span[1] < start and os.path.getsize(index.path) <= index.end:
+                continue
+            lo = None if start is None else index.mono + int((start - index.wall)*1e9)
+            hi = None if end is None else index.mono + int((end - index.wall)*1e9)
+            data = _open_segment(index.path)
+            if data is None:
+                continue
+            try:
+                self._scan(index,data,layout,size,lo,hi,serials,times,frames)
+            finally:
+                data.close()
+        if frames:
+            columns = self.decoder.decode_many(layout,frames)
+        else:
+            columns = {name:np.array([]) for name in self.decoder.layouts[layout].names}
+        columns['time'] = np.array(times,dtype=np.float64)
+        return columns
+
+    def _scan(self,index,data,layout,size,lo,hi,serials,times,frames):
+        matcher = None
+        position = None
+        #The tail written since the index was last saved has no blocks yet, it is always read
+        tail = {'start':index.end,'end':len(data),'serials':None,'carry':index._carry()}
+        for block in index.blocks + [tail]:
+            if block['serials'] is not None:
+                wanted = any(layout in counts for serial,counts in block['serials'].items()
+                             if serials is None or serial in serials)
+                if not wanted or (lo is not None and block['t1'] < lo) or (hi is not None and block['t0'] > hi):
+                    self.counters['skipped'] += 1
+                    continue
+                self.counters['blocks'] += 1
+            else:
+                self.counters['unindexed'] += 1
+            if position != block['start']:
+                #Not straight after the last block read, start over from what was waiting here
+                matcher = ResponseMatcher({(a,b):kind for a,b,kind in block['carry']})
+            position = block['end']
+            for _,_,record in scan_records(data,index.wall,index.mono,dict(index.ports),block['start'],block['end']):
+                if record.protocol != 'usb':
+                    continue
+                if record.direction == TX:
+                    matcher.sent(record.frame)
+                    continue
+                if matcher.answered(record.frame) != layout:
+                    continue
+                if (lo is not None and record.mono < lo) or (hi is not None and record.mono > hi):
+                    continue
+                if serials is not None and record.serial not in serials:
+                    continue
+                frame = record.frame
+                #decode_many skips what it cannot decode, keep the time column in step with it
+                if len(frame) >= size and frame[0] == 0x0D and 4 + frame[1] == len(frame):
+                    times.append(record.wall)
+                    frames.append(frame)
+
+    def summary(self):
+        #Answers per robot and type with the first and last time each robot was heard, from the indexes alone
+        robots = {}
+        first = last = None
+        for index in self.indexes():
+            for block in index.blocks:
+                t0 = index.wall + (block['t0'] - index.mono)/1e9
+                t1 = index.wall + (block['t1'] - index.mono)/1e9
+                first = t0 if first is None else min(first,t0)
+                last = t1 if last is None else max(last,t1)
+                for serial,counts in block['serials'].items():
+                    robot = robots.setdefault(serial,{'serial':serial,'first':t0,'last':t1,'counts':{}})
+                    robot['first'] = min(robot['first'],t0)
+                    robot['last'] = max(robot['last'],t1)
+                    for kind,n in counts.items():
+                        robot['counts'][kind] = robot['counts'].get(kind,0) + n
+        return {'sessions':len(self.sessions()),
+                'first':first,
+                'last':last,
+                'robots':[robots[serial] for serial in sorted(robots)],
+                }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the time/robot indexes of flight recorder sessions')
+    parser.add_argument('root',nargs='?',default='recordings',help='directory holding the sessions')
+    parser.add_argument('--workers',type=int,help='processes, defaults to one per CPU')
+    parser.add_argument('--force',action='store_true',help='rebuild indexes that look up to date too')
+    parser.add_argument('--block-seconds',type=float,default=1.0)
+    parser.add_argument('--block-records',type=int,default=1024)
+    args = parser.parse_args()
+    start = time.monotonic()
+    built = build_indexes(args.root,args.workers,args.force,args.block_seconds,args.block_records)
+    elapsed = time.monotonic() - start
+    records = sum(n for _,_,n in built)
+    print(f'Indexed {len(built)} segments, {records} records in {elapsed:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import math
+import threading
+
+
+#Sub-buckets per power of two, 2**7 keeps every recorded value within 1% like an HDR histogram with 2 significant digits
+SUB_BITS = 7
+HALF = 1 << (SUB_BITS - 1)
+#Values are recorded in whole microseconds
+UNIT = 1e-6
+#Bucket bounds in seconds for the Prometheus export
+BOUNDS = (0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+QUANTILES = (0.5,0.9,0.99,0.999)
+
+
+class Histogram:
+    #Log-linear buckets: exact below 2**SUB_BITS us, then 2**(SUB_BITS-1) buckets per power of two.
+    #Recording is a bit_length and a shift, memory grows with the largest value seen (about 2k buckets for 10 s)
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def index(value):
+        exp = max(0,value.bit_length() - SUB_BITS)
+        return exp*HALF + (value >> exp)
+
+    @staticmethod
+    def upper(idx):
+        #Largest value, in units, that lands in bucket idx
+        exp = max(0,idx//HALF - 1)
+        return ((idx - exp*HALF + 1) << exp) - 1
+
+    def record(self,seconds):
+        idx = self.index(max(0,int(seconds/UNIT)))
+        with self.lock:
+            if idx >= len(self.counts):
+                self.counts.extend([0]*(idx + 1 - len(self.counts)))
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self,q):
+        with self.lock:
+            counts,count = list(self.counts),self.count
+        if not count:
+            return math.nan
+        rank = max(1,math.ceil(q*count))
+        seen = 0
+        for idx,n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return self.upper(idx)*UNIT
+        return self.max
+
+    def buckets(self,bounds=BOUNDS):
+        #Cumulative counts at each bound, what a Prometheus histogram expects. A bucket only counts once all of it
+        #is below the bound, one straddling it would report values up to 1% above le as <= le
+        with self.lock:
+            counts = list(self.counts)
+        out,seen,idx = [],0,0
+        for bound in bounds:
+            limit = round(bound/UNIT)
+            while idx < len(counts) and self.upper(idx) < limit:
+                seen += counts[idx]
+                idx += 1
+            out.append(seen)
+        return out
+
+    def summary(self):
+        #Milliseconds, same keys as HTT.summarize_waits plus the tail
+        if not self.count:
+            return {'count':0}
+        return {'count':self.count,
+                'mean':1000*self.sum/self.count,
+                'p50':1000*self.percentile(0.5),
+                'p99':1000*self.percentile(0.99),
+                'max':1000*self.max,
+                }
+
+
+def _labels(labels):
+    return ','.join(f'{k}="{v}"' for k,v in labels)
+
+
+def _series(name,labels):
+    return f'{name}{{{_labels(labels)}}}' if labels else name
+
+
+class Metrics:
+    #Histograms and counters keyed by name and labels, rendered in the Prometheus text format
+    def __init__(self,prefix='htt'):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def describe(self,name,text):
+        self.help[name] = text
+
+    def histogram(self,name,**labels):
+        key = (name,tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(key,Histogram())
+        return hist
+
+    def observe(self,name,seconds,**labels):
+        self.histogram(name,**labels).record(seconds)
+
+    def inc(self,name,n=1,**labels):
+        key = (name,tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key,0) + n
+
+    def value(self,name,**labels):
+        return self.counters.get((name,tuple(sorted(labels.items()))),0)
+
+    def render(self,gauges=(),totals=()):
+        #gauges and totals are (name, labels dict, value) read at scrape time, e.g. queue depth and bytes sent
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        counters += sorted(((name,tuple(sorted(labels.items()))),value) for name,labels,value in totals)
+        lines = []
+        described = set()
+
+        def header(name,kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self.help:
+                lines.append(f'# HELP {self.prefix}_{name} {self.help[name]}')
+            lines.append(f'# TYPE {self.prefix}_{name} {kind}')
+
+        for (name,labels),value in counters:
+            header(name,'counter')
+            lines.append(f'{_series(self.prefix + "_" + name,labels)} {value}')
+        for name,labels,value in sorted(gauges,key=lambda g:g[0]):
+            header(name,'gauge')
+            lines.append(f'{_series(self.prefix + "_" + name,sorted(labels.items()))} {float(value):g}')
+        for (name,labels),hist in histograms:
+            header(name,'histogram')
+            base = _labels(labels)
+            sep = ',' if base else ''
+            for bound,count in zip(BOUNDS,hist.buckets()):
+                lines.append(f'{self.prefix}_{name}_bucket{{{base}{sep}le="{bound:g}"}} {count}')
+            lines.append(f'{self.prefix}_{name}_bucket{{{base}{sep}le="+Inf"}} {hist.count}')
+            lines.append(f'{_series(self.prefix + "_" + name + "_sum",labels)} {hist.sum:.6f}')
+            lines.append(f'{_series(self.prefix + "_" + name + "_count",labels)} {hist.count}')
+        #The HDR tail, which fixed buckets blur, as gauges next to each histogram
+        for (name,labels),hist in histograms:
+            if not hist.count:
+                continue
+            header(f'{name}_quantile','gauge')
+            base = _labels(labels)
+            sep = ',' if base else ''
+            for q in QUANTILES:
+                lines.append(f'{self.prefix}_{name}_quantile{{{base}{sep}quantile="{q:g}"}} {hist.percentile(q):.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+#Shared by the radio stacks and the Flask app unless one is passed in
+REGISTRY = Metrics()
+REGISTRY.describe('radio_seconds','Time per stage of a radio request: queue, write, response, decode')
+REGISTRY.describe('radio_timeouts_total','Requests written to the radio that got no answer in time')
+REGISTRY.describe('radio_stray_total','Answers that fit no request in flight, e.g. late ones after a timeout')
+REGISTRY.describe('radio_retries_total','Packets sent again after a missing or wrong ack')
+REGISTRY.describe('radio_failed_total','Requests failed because the radio went away')
+REGISTRY.describe('joystick_dropped_total','Joystick updates that never went on the air, by reason')
+REGISTRY.describe('joystick_inputs_total','Joystick inputs sent on to the radio, merged into a newer one or discarded by a stop, by result')
+REGISTRY.describe('joystick_rtt_seconds','Round trip of a joystick update and its ack on the WebSocket channel')
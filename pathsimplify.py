@@ -0,0 +1,113 @@
+import heapq
+
+import numpy as np
+
+
+def _segment_distances(points, start, end):
+    #Distance in metres of every point to the segment start-end
+    seg = end - start
+    length2 = float(seg @ seg)
+    if length2 == 0:
+        return np.hypot(*(points - start).T)
+    t = np.clip(((points - start) @ seg) / length2, 0.0, 1.0)
+    nearest = start + t[:, None] * seg
+    return np.hypot(*(points - nearest).T)
+
+
+def _anchors(flags):
+    #Endpoints and every point where the waypoint flag changes are never removed
+    anchors = np.zeros(len(flags), dtype=bool)
+    anchors[0] = anchors[-1] = True
+    anchors[1:] |= flags[1:] != flags[:-1]
+    return anchors
+
+
+def douglas_peucker(xy, tolerance, anchors=None):
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool) if anchors is None else anchors.copy()
+    keep[0] = keep[-1] = True
+    fixed = np.flatnonzero(keep)
+    stack = list(zip(fixed[:-1], fixed[1:]))
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dist = _segment_distances(xy[first + 1:last], xy[first], xy[last])
+        worst = int(np.argmax(dist))
+        if dist[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def visvalingam(xy, tolerance, anchors=None):
+    #Drops the point with the smallest effective triangle until every area is above tolerance**2
+    n = len(xy)
+    keep = np.ones(n, dtype=bool)
+    if n < 3:
+        return keep
+    fixed = np.zeros(n, dtype=bool) if anchors is None else anchors.copy()
+    fixed[0] = fixed[-1] = True
+    prev = np.arange(-1, n - 1)
+    nxt = np.arange(1, n + 1)
+
+    def area(i):
+        a, b, c = xy[prev[i]], xy[i], xy[nxt[i]]
+        return abs((b[0] - a[0]) * (c[1] - a[1]) - (c[0] - a[0]) * (b[1] - a[1])) / 2
+
+    a, b, c = xy[:-2], xy[1:-1], xy[2:]
+    areas = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2
+    heap = [(areas[i - 1], i) for i in range(1, n - 1) if not fixed[i]]
+    heapq.heapify(heap)
+    current = {i: area_ for area_, i in heap}
+    threshold = tolerance ** 2
+    while heap:
+        area_, i = heapq.heappop(heap)
+        if not keep[i] or current.get(i) != area_:
+            continue
+        if area_ > threshold:
+            break
+        keep[i] = False
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if not fixed[j]:
+                current[j] = area(j)
+                heapq.heappush(heap, (current[j], j))
+    return keep
+
+
+def max_deviation(xy, keep):
+    #Largest distance from a dropped point to the simplified line that replaced it
+    kept = np.flatnonzero(keep)
+    worst = 0.0
+    for first, last in zip(kept[:-1], kept[1:]):
+        if last - first > 1:
+            worst = max(worst, float(_segment_distances(xy[first + 1:last], xy[first], xy[last]).max()))
+    return worst
+
+
+def simplify(waypoints, tolerance=1.0, method='dp'):
+    #waypoints are (utmX, utmY, flag) tuples as stored in app.WAYPOINTS
+    report = {'method': method, 'tolerance': tolerance, 'before': len(waypoints)}
+    if len(waypoints) < 3 or tolerance <= 0:
+        report.update({'after': len(waypoints), 'removed': 0, 'max_deviation': 0.0})
+        return list(waypoints), report
+
+    data = np.asarray(waypoints, dtype=float)
+    xy, flags = data[:, :2], data[:, 2]
+    anchors = _anchors(flags)
+    if method == 'dp':
+        keep = douglas_peucker(xy, tolerance, anchors)
+    elif method == 'vw':
+        keep = visvalingam(xy, tolerance, anchors)
+    else:
+        raise ValueError(f'Unknown simplification method {method}')
+
+    simplified = [waypoints[i] for i in np.flatnonzero(keep)]
+    report.update({'after': len(simplified),
+                   'removed': len(waypoints) - len(simplified),
+                   'max_deviation': round(max_deviation(xy, keep), 3)})
+    return simplified, report
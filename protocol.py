@@ -0,0 +1,164 @@
+import hashlib
+import json
+import marshal
+import os
+import struct
+import sys
+
+import numpy as np
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCHEMA = os.path.join(HERE,'protocol.json')
+CACHE = os.path.join(HERE,'__pycache__')
+
+#struct code -> NumPy dtype for decode_many columns
+DTYPES = {'B':'u1','b':'i1','H':'<u2','h':'<i2','I':'<u4','i':'<i4','f':'<f4'}
+
+
+def tenths(value):
+    return value / 10.
+
+
+def flag(value):
+    return bool(value)
+
+
+def flag_column(value):
+    return value.astype(bool)
+
+
+def converters(schema):
+    #Converter name -> (single decode, column decode), None keeps the raw column
+    table = {'tenths':(tenths,tenths),
+             'flag':(flag,flag_column),
+             }
+    for name,bits in schema.get('flags',{}).items():
+        def convert(value,bits=tuple(bits)):
+            return [label for bit,label in bits if value & bit]
+        table[name] = (convert,None)
+    return table
+
+
+class Codec:
+    #One message of the schema: compiled struct, record dtype and the generated decode function
+    def __init__(self,name,fields,convert,rest=None,min_size=None):
+        self.name = name
+        self.rest = rest
+        self.convert = convert
+        self.columns = {field:column for field,(_,column) in convert.items() if column is not None}
+        #(field, struct code) as written in the schema, base fields first
+        self.layout = list(fields)
+        self.fields = []
+        names,formats,offsets = [],[],[]
+        fmt = '<'
+        offset = 0
+        for field,code in fields:
+            count,kind = int(code[:-1] or 1),code[-1]
+            fmt += code
+            if kind != 'x':
+                #'6s' unpacks to one bytes value, '4B' to four ints
+                self.fields.append((field,1 if kind == 's' else count))
+                names.append(field)
+                if kind == 's':
+                    formats.append(f'S{count}')
+                else:
+                    formats.append(DTYPES[kind] if count == 1 else (DTYPES[kind],(count,)))
+                offsets.append(offset)
+            offset += struct.calcsize('<'+code)
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        self.min_size = self.size if min_size is None else min_size
+        self.pack = self.struct.pack
+        self.unpack_from = self.struct.unpack_from
+        self.names = tuple(names)
+        self.dtype = np.dtype({'names':names,'formats':formats,'offsets':offsets,'itemsize':self.size})
+        self.decode = None
+
+    def source(self):
+        #decode(pack) as one dict literal over the unpacked tuple, the fastest form in CPython
+        items = []
+        bound = [f'unpack_from=STRUCTS[{self.name!r}].unpack_from']
+        idx = 0
+        for field,count in self.fields:
+            value = f'v[{idx}]' if count == 1 else '['+','.join(f'v[{i}]' for i in range(idx,idx+count))+']'
+            if field in self.convert:
+                bound.append(f'c{idx}=CONVERT[{self.name!r}][{field!r}][0]')
+                value = f'c{idx}({value})'
+            items.append(f'{field!r}:{value}')
+            idx += count
+        if self.rest:
+            items.append(f'{self.rest!r}:bytes(pack[{self.size}:])')
+        return (f'def decode_{self.name}(pack,{",".join(bound)}):\n'
+                f'    v = unpack_from(pack)\n'
+                f'    return {{{",".join(items)}}}\n')
+
+
+class Protocol:
+    #One transport of the schema: type ids plus its request and response codecs
+    def __init__(self,name,spec,table):
+        self.name = name
+        self.header = spec.get('header')
+        self.types = dict(spec.get('types',{}))
+        self.requests = self._codecs('req',spec.get('requests',{}),table)
+        self.responses = self._codecs('resp',spec.get('responses',{}),table)
+
+    def _codecs(self,kind,specs,table):
+        def fields(spec):
+            base = specs[spec['base']] if 'base' in spec else {}
+            return (fields(base) if base else []) + [tuple(field) for field in spec.get('fields',[])]
+        return {key:Codec(f'{self.name}_{kind}_{key}'.replace('/','_'),fields(spec),
+                          {field:table[name] for field,name in spec.get('convert',{}).items()},
+                          spec.get('rest'),spec.get('min_size'))
+                for key,spec in specs.items()}
+
+    def codecs(self):
+        return list(self.requests.values()) + list(self.responses.values())
+
+
+def generate(codecs):
+    return '#Generated from protocol.json, edit the schema instead\n\n' + '\n'.join(codec.source() for codec in codecs)
+
+
+def load(path=SCHEMA,cache=CACHE):
+    #Builds every codec in the schema, the generated decoders are compiled once and cached in __pycache__
+    with open(path,'rb') as f:
+        raw = f.read()
+    #The generator is part of the key too, changing how code is generated must not reuse older code
+    with open(os.path.abspath(__file__),'rb') as f:
+        digest = hashlib.sha1(raw + f.read()).hexdigest()[:16]
+    cached = os.path.join(cache,f'protocol.{digest}.{sys.implementation.cache_tag}.bin')
+    try:
+        with open(cached,'rb') as f:
+            schema,code = marshal.load(f)
+    except (OSError,EOFError,ValueError,TypeError):
+        schema,code = json.loads(raw),None
+
+    table = converters(schema)
+    protocols = {name:Protocol(name,spec,table) for name,spec in schema['transports'].items()}
+    codecs = [codec for protocol in protocols.values() for codec in protocol.codecs()]
+    if code is None:
+        code = compile(generate(codecs),f'<protocol {digest}>','exec')
+        try:
+            os.makedirs(cache,exist_ok=True)
+            with open(cached+'.tmp','wb') as f:
+                marshal.dump((schema,code),f)
+            os.replace(cached+'.tmp',cached)
+        except OSError:
+            #Read-only install, generate again on the next start
+            pass
+
+    scope = {'STRUCTS':{codec.name:codec.struct for codec in codecs},
+             'CONVERT':{codec.name:codec.convert for codec in codecs},
+             }
+    exec(code,scope)
+    for codec in codecs:
+        codec.decode = scope[f'decode_{codec.name}']
+    return schema,protocols
+
+
+SCHEMA_DATA,PROTOCOLS = load()
+USB = PROTOCOLS['usb']
+CL4790 = PROTOCOLS['cl4790']
+#Robot error bitmask -> name, in the order get_errors reports them
+ERRORS = {bit:label for bit,label in SCHEMA_DATA['flags']['errors']}
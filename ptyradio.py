@@ -0,0 +1,109 @@
+import heapq
+import os
+import pty
+import random
+import threading
+import time
+import tty
+
+
+class PtyRadio:
+    #Pseudo-terminal radio: subclasses cut host packets out of the byte stream and answer them.
+    #Answers go out after latency plus up to jitter seconds, packets and answers are lost with chance loss
+    def __init__(self,latency=0.02,jitter=0.0,loss=0.0,seed=None):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.counters = {'rx':0,'tx':0,'lost':0,'unknown':0,'garbage':0}
+        self.outbox = []
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.threads = []
+        self.master = self.slave = None
+        self.port = None
+
+    def start(self):
+        self.master,self.slave = pty.openpty()
+        #Raw so the line discipline neither echoes nor rewrites 0x0A/0x0D bytes
+        tty.setraw(self.slave)
+        tty.setraw(self.master)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.threads = [threading.Thread(target=self._rx_task,daemon=True),
+                        threading.Thread(target=self._tx_task,daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        for fd in (self.master,self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        for thread in self.threads:
+            thread.join(1.0)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    def frames(self,buf):
+        #Yields complete host packets and removes them from buf
+        raise NotImplementedError
+
+    def receive(self,packet):
+        raise NotImplementedError
+
+    def lost(self):
+        if self.loss and self.rng.random() < self.loss:
+            self.counters['lost'] += 1
+            return True
+        return False
+
+    def send(self,response):
+        due = time.monotonic() + self.latency + (self.rng.uniform(0,self.jitter) if self.jitter else 0)
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.outbox,(due,self.seq,response))
+            self.cond.notify_all()
+
+    def _rx_task(self):
+        buf = bytearray()
+        while self.running:
+            try:
+                data = os.read(self.master,4096)
+            except OSError:
+                #No client has the port open yet, or it just closed it
+                time.sleep(0.01)
+                continue
+            buf += data
+            for packet in self.frames(buf):
+                self.counters['rx'] += 1
+                self.receive(packet)
+
+    def _tx_task(self):
+        while self.running:
+            with self.cond:
+                if not self.outbox:
+                    self.cond.wait(0.1)
+                    continue
+                due,_,response = self.outbox[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.outbox)
+            try:
+                os.write(self.master,response)
+                self.counters['tx'] += 1
+            except OSError:
+                pass
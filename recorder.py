@@ -0,0 +1,264 @@
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+
+#Segment header: magic, version, header size, segment index, capacity, wall clock and monotonic ns at creation, end of data
+SEGMENT_HEADER = struct.Struct('<8sHHIQdqQ')
+HEADER_SIZE = 64
+MAGIC = b'HTTREC\x00\x01'
+VERSION = 1
+#Record header: monotonic ns, robot serial, frame length, flags, port id, then the frame itself
+RECORD = struct.Struct('<qHHBB')
+TX = 0
+RX = 1
+#Flag of the records that name a port id, their frame is b'protocol\0port name'
+PORT = 0x80
+
+Record = namedtuple('Record','mono wall direction protocol port serial frame')
+
+
+def frame_serial(protocol,direction,frame):
+    #USB host packets carry only the serial's two low nibbles, responses the full LE16 serial.
+    #CL4790 payloads start with the client id either way
+    if protocol == 'cl4790':
+        return frame[0] if frame else 0
+    if len(frame) < 4:
+        return 0
+    if direction == RX:
+        return frame[2] | (frame[3] << 8)
+    return (frame[2] & 0xF) | ((frame[3] & 0xF) << 4)
+
+
+class Segment:
+    #One fixed-size memory-mapped file, records are appended and the header's end moves on every sync
+    def __init__(self,path,index,size):
+        self.path = path
+        self.index = index
+        self.size = size
+        self.file = open(path,'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(),size)
+        self.wall = time.time()
+        self.mono = time.monotonic_ns()
+        self.end = HEADER_SIZE
+        self.synced = HEADER_SIZE
+        self._header()
+
+    def _header(self):
+        SEGMENT_HEADER.pack_into(self.map,0,MAGIC,VERSION,HEADER_SIZE,self.index,self.size,self.wall,self.mono,self.end)
+
+    def append(self,mono,serial,flags,port,frame):
+        #False when the segment is full, the frame goes first so a torn record never looks complete
+        end = self.end + RECORD.size + len(frame)
+        if end > self.size:
+            return False
+        self.map[self.end + RECORD.size:end] = frame
+        RECORD.pack_into(self.map,self.end,mono,serial,len(frame),flags,port)
+        self.end = end
+        return True
+
+    def sync(self):
+        if self.end != self.synced:
+            self._header()
+            self.map.flush()
+            self.synced = self.end
+
+    def close(self):
+        #Closed segments are trimmed to what they hold
+        self.sync()
+        self.map.close()
+        self.file.truncate(self.end)
+        self.file.close()
+
+
+class FlightRecorder:
+    #Appends every TX/RX frame to segmented binary logs in directory.
+    #record() only stamps the frame and appends it to a deque, a background thread writes and syncs the segments
+    def __init__(self,directory=None,segment_size=8 << 20,flush_interval=0.2,sync_interval=1.0,max_pending=100000,index=None):
+        self.directory = directory or os.path.join('recordings',time.strftime('%Y%m%d-%H%M%S'))
+        #Called with (segment path, wall, mono) for every new segment, e.g. logindex.SegmentIndex.
+        #Its port(), add() and save() keep a time/robot index next to the segment as it is written
+        self.index = index
+        self.segment_index = None
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.ports = {}
+        self.segment = None
+        self.segments = 0
+        self.counters = {'records':0,'bytes':0,'dropped':0}
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return self
+        self.segments = len(segment_paths(self.directory))
+        self.running = True
+        self.thread = threading.Thread(target=self._write_task,daemon=True)
+        self.thread.start()
+        return self
+
+    def record(self,direction,port,frame,protocol='usb',mono=None):
+        #Called from the radio threads, so nothing here touches the disk. mono (ns) is for tools re-recording old traffic
+        if len(self.pending) >= self.max_pending:
+            self.counters['dropped'] += 1
+            return
+        self.pending.append((mono or time.monotonic_ns(),direction,protocol,port,frame))
+
+    def _open(self):
+        #The session directory appears with its first frame, a server without a radio leaves nothing behind
+        os.makedirs(self.directory,exist_ok=True)
+        path = os.path.join(self.directory,f'seg-{self.segments:06d}.htr')
+        self.segment = Segment(path,self.segments,self.segment_size)
+        self.segment_index = self.index(path,self.segment.wall,self.segment.mono) if self.index else None
+        self.segments += 1
+        #Every segment names its ports again so it can be read on its own
+        for (protocol,port),port_id in self.ports.items():
+            self.segment.append(self.segment.mono,0,PORT,port_id,f'{protocol}\0{port}'.encode())
+            if self.segment_index is not None:
+                self.segment_index.port(port_id,protocol,port)
+
+    def _sync(self):
+        self.segment.sync()
+        if self.segment_index is not None:
+            self.segment_index.save()
+
+    def _close(self):
+        self.segment.close()
+        if self.segment_index is not None:
+            self.segment_index.save()
+        self.segment = self.segment_index = None
+
+    def _port(self,protocol,port):
+        port_id = self.ports.get((protocol,port))
+        if port_id is None:
+            port_id = self.ports[(protocol,port)] = len(self.ports) & 0xFF
+            if not self.segment.append(time.monotonic_ns(),0,PORT,port_id,f'{protocol}\0{port}'.encode()):
+                #The next segment names all ports, this one included
+                self._close()
+                self._open()
+            elif self.segment_index is not None:
+                self.segment_index.port(port_id,protocol,port)
+        return port_id
+
+    def _append(self,mono,serial,direction,port_id,frame,protocol):
+        offset = self.segment.end
+        if not self.segment.append(mono,serial,direction,port_id,frame):
+            return False
+        if self.segment_index is not None:
+            self.segment_index.add(offset,self.segment.end,mono,direction,protocol,serial,frame)
+        return True
+
+    def _drain(self):
+        pending = self.pending
+        while pending:
+            item = pending.popleft()
+            if isinstance(item,threading.Event):
+                #A flush() marker, everything queued before it is written
+                if self.segment is not None:
+                    self._sync()
+                item.set()
+                continue
+            mono,direction,protocol,port,frame = item
+            if self.segment is None:
+                self._open()
+            port_id = self._port(protocol,port)
+            serial = frame_serial(protocol,direction,frame)
+            if not self._append(mono,serial,direction,port_id,frame,protocol):
+                self._close()
+                self._open()
+                self._append(mono,serial,direction,port_id,frame,protocol)
+            self.counters['records'] += 1
+            self.counters['bytes'] += len(frame)
+
+    def _write_task(self):
+        synced = time.monotonic()
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self._drain()
+                if self.segment is not None and time.monotonic() - synced >= self.sync_interval:
+                    self._sync()
+                    synced = time.monotonic()
+            except Exception as e:
+                print(f'Flight recorder error: {e}')
+        self._drain()
+        if self.segment is not None:
+            self._close()
+
+    def flush(self,timeout=5.0):
+        #Write out and sync what is queued so far, before reading a live session
+        done = threading.Event()
+        self.pending.append(done)
+        self.wake.set()
+        return done.wait(timeout)
+
+    def stats(self):
+        return {'directory':self.directory,
+                **self.counters,
+                'pending':len(self.pending),
+                'segments':self.segments,
+                }
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def segment_header(data,path=''):
+    #(header size, wall clock, monotonic ns) of a segment's bytes
+    magic,version,header,index,size,wall,mono,end = SEGMENT_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a flight recorder segment')
+    return header,wall,mono
+
+
+def scan_records(data,wall,mono,ports,offset=HEADER_SIZE,limit=None):
+    #(offset, next offset, Record) from data[offset:limit], port records fill ports {id: (protocol, name)} as they pass
+    limit = len(data) if limit is None else min(limit,len(data))
+    while offset + RECORD.size <= limit:
+        t,serial,length,flags,port = RECORD.unpack_from(data,offset)
+        start = offset + RECORD.size
+        if t == 0 or start + length > limit:
+            break
+        frame = data[start:start+length]
+        if flags & PORT:
+            protocol,_,name = frame.decode().partition('\0')
+            ports[port] = (protocol,name)
+        else:
+            protocol,name = ports.get(port,('usb',str(port)))
+            yield offset,start + length,Record(t,wall + (t - mono)/1e9,flags & RX,protocol,name,serial,frame)
+        offset = start + length
+
+
+def read_segment(path):
+    #Yields the Records of one segment, also the tail of one whose process died before its last sync
+    with open(path,'rb') as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        return
+    header,wall,mono = segment_header(data,path)
+    for _,_,record in scan_records(data,wall,mono,{},header):
+        yield record
+
+
+def segment_paths(directory):
+    return sorted(glob.glob(os.path.join(directory,'seg-*.htr')))
+
+
+def read_recording(directory):
+    #Every Record of a session in the order it was written
+    for path in segment_paths(directory):
+        yield from read_segment(path)
@@ -0,0 +1,142 @@
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+from HTT import Decoders, ResponseMatcher
+from recorder import RX, TX, read_recording
+
+
+#Decoded response -> TelemetryCache field, the same fields TelemetryPoller fills
+CACHE_FIELDS = {'gps':'gps','system':'system','hit':'hit','bat1':'battery'}
+
+
+class Replayer:
+    #Streams a recorded session back through Decoders, and the CL4790 payloads through an HTTRadioController.
+    #speed 1 is real time, 10 ten times faster, 0 as fast as possible
+    def __init__(self,directory,speed=1.0,decoder=None,controller=None,cache=None,fleet=None,callback=None):
+        self.directory = directory
+        self.speed = speed
+        self.decoder = decoder or Decoders()
+        #Anything with _process_received_packet, e.g. HTTRadioController from HTT-Direct.py
+        self.controller = controller
+        #TelemetryCache and Fleet to fill as if the poller had asked, e.g. the Flask app's
+        self.cache = cache
+        self.fleet = fleet
+        #Called with (record, packet type, decoded) for every decoded USB response
+        self.callback = callback
+        self.running = False
+        self.counters = {}
+
+    def _count(self,key):
+        self.counters[key] = self.counters.get(key,0) + 1
+
+    def _usb(self,record,matcher):
+        frame = record.frame
+        if record.direction == TX:
+            matcher.sent(frame)
+            return
+        kind = matcher.answered(frame)
+        if kind is None:
+            self._count('unmatched')
+            return
+        try:
+            decoded = self.decoder.decode(kind,frame)
+        except Exception:
+            self._count('errors')
+            return
+        self._count(kind)
+        if self.fleet is not None and record.serial not in self.fleet:
+            self.fleet.add(record.serial)
+        if self.cache is not None and kind in CACHE_FIELDS:
+            self.cache.update(record.serial,CACHE_FIELDS[kind],decoded)
+        if self.callback is not None:
+            self.callback(record,kind,decoded)
+
+    def run(self,records=None):
+        #Replays once and returns what went through, records defaults to the whole recording
+        records = read_recording(self.directory) if records is None else records
+        self.running = True
+        self.counters = {'records':0}
+        matcher = ResponseMatcher()
+        first = None
+        late = 0.0
+        start = time.monotonic()
+        for record in records:
+            if not self.running:
+                break
+            if self.speed:
+                first = record.wall if first is None else first
+                ahead = (record.wall - first)/self.speed - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+                else:
+                    late = max(late,-ahead)
+            self.counters['records'] += 1
+            if record.protocol == 'cl4790':
+                if record.direction == RX and self.controller is not None:
+                    self.controller._process_received_packet(record.frame)
+                    self._count('cl4790')
+            else:
+                self._usb(record,matcher)
+        elapsed = time.monotonic() - start
+        stats = dict(self.counters)
+        stats['seconds'] = elapsed
+        stats['records_per_s'] = stats['records']/elapsed if elapsed else 0.0
+        #How far behind the recorded timing the replay fell at worst
+        stats['max_late'] = late
+        return stats
+
+    def start(self,loop=False):
+        #Replays in the background, e.g. behind the Flask app
+        def task():
+            while True:
+                print(f'Replay of {self.directory}: {self.run()}')
+                if not loop or not self.running:
+                    break
+        thread = threading.Thread(target=task,daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.running = False
+
+
+def load_controller(num_clients):
+    #HTT-Direct.py imports its CL4790 driver as "radio", which ships as radio-direct.py
+    root = os.path.dirname(os.path.abspath(__file__))
+    modules = {}
+    for name,filename in (('radio','radio-direct.py'),('htt_direct','HTT-Direct.py')):
+        spec = importlib.util.spec_from_file_location(name,os.path.join(root,filename))
+        modules[name] = importlib.util.module_from_spec(spec)
+        sys.modules[name] = modules[name]
+        spec.loader.exec_module(modules[name])
+    return modules['htt_direct'].HTTRadioController(num_clients=num_clients)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a flight recorder session through the decoders')
+    parser.add_argument('directory',help='session directory, e.g. recordings/20250401-130701')
+    parser.add_argument('--speed',type=float,default=1.0,help='times real time, 0 for as fast as possible')
+    parser.add_argument('--cl4790',type=int,metavar='CLIENTS',help='also feed CL4790 payloads to an HTTRadioController')
+    parser.add_argument('--serve',action='store_true',help='fill the Flask app telemetry and serve it as if live')
+    parser.add_argument('--loop',action='store_true',help='start over at the end, with --serve')
+    parser.add_argument('--host',default='0.0.0.0')
+    parser.add_argument('--port',type=int,default=5000)
+    args = parser.parse_args()
+    controller = load_controller(args.cl4790) if args.cl4790 else None
+    if not args.serve:
+        print(Replayer(args.directory,args.speed,controller=controller).run())
+        return
+    import app
+    #The replay stands in for the radio, so the poller has nothing to do
+    app.POLLER.stop()
+    replayer = Replayer(args.directory,args.speed,controller=controller,cache=app.TELEMETRY,fleet=app.FLEET)
+    replayer.start(loop=args.loop)
+    app.app.run(host=args.host,port=args.port,threaded=True)
+
+
+if __name__ == '__main__':
+    main()
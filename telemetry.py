@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import deque
+
+from HTT import RadioTimeout
+
+
+class Subscription:
+    #One client's bounded queue of (time, serial, field, value), a full queue drops its oldest update
+    def __init__(self,serials=None,fields=None,maxsize=64):
+        self.serials = None if serials is None else set(serials)
+        self.fields = None if fields is None else set(fields)
+        self.queue = deque(maxlen=maxsize)
+        self.ready = threading.Condition()
+        self.dropped = 0
+
+    def wants(self,serial,field):
+        return (self.serials is None or serial in self.serials) and (self.fields is None or field in self.fields)
+
+    def put(self,event):
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(event)
+            self.ready.notify()
+
+    def get(self,timeout=None):
+        #Oldest queued update, None when nothing came within timeout
+        with self.ready:
+            if not self.queue:
+                self.ready.wait(timeout)
+            return self.queue.popleft() if self.queue else None
+
+
+class TelemetryStream:
+    #Fans every cache update out to the subscribed clients, each through its own bounded queue.
+    #publish() runs on the radio threads, a slow client loses its oldest updates and never holds them up
+    def __init__(self,maxsize=64):
+        self.maxsize = maxsize
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self,serials=None,fields=None):
+        subscription = Subscription(serials,fields,self.maxsize)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self,subscription):
+        with self.lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+                self.dropped += subscription.dropped
+
+    def publish(self,serial,field,value):
+        event = (time.time(),serial,field,value)
+        with self.lock:
+            subscribers = list(self.subscribers)
+            #The poller's callbacks and request threads publish at once
+            self.published += 1
+        for subscription in subscribers:
+            if subscription.wants(serial,field):
+                subscription.put(event)
+
+    def stats(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+            published,dropped = self.published,self.dropped
+        return {'subscribers':len(subscribers),
+                'published':published,
+                'dropped':dropped + sum(s.dropped for s in subscribers),
+                }
+
+
+class TelemetryCache:
+    def __init__(self,ttl=None,stream=None):
+        #Values older than ttl seconds are treated as missing. By default twice the slowest poll interval,
+        #a value must outlive the wait for its own refresh even when that answer comes late
+        self.ttl = 2*max(interval for _,interval in TelemetryPoller.fields.values()) if ttl is None else ttl
+        self.data = {}
+        self.lock = threading.Lock()
+        #TelemetryStream told of every update, for the pages that subscribe instead of polling
+        self.stream = stream
+
+    def update(self,serial,field,value):
+        with self.lock:
+            self.data.setdefault(serial,{})[field] = (time.time(),value)
+        if self.stream is not None:
+            self.stream.publish(serial,field,value)
+
+    def get(self,serial,field,max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            stamped = self.data.get(serial,{}).get(field)
+        if stamped is None or time.time()-stamped[0] > max_age:
+            return None
+        return stamped[1]
+
+    def snapshot(self,serial):
+        now = time.time()
+        with self.lock:
+            fields = dict(self.data.get(serial,{}))
+        return {field:{'age':round(now-stamp,3),
+                       'stale':now-stamp > self.ttl,
+                       'data':value}
+                for field,(stamp,value) in fields.items()}
+
+
+class TelemetryPoller:
+    #Cache field -> (packet type asked for, refresh interval in seconds)
+    fields = {'gps':('gps',1.0),
+              'system':('system',5.0),
+              'hit':('hit',5.0),
+              'battery':('bat1',10.0),
+              }
+
+    def __init__(self,htt,cache,fleet,window=1):
+        self.htt = htt
+        self.cache = cache
+        self.fleet = fleet
+        #Requests in the air at once, at most one per robot. Only helps when the radio pipelines (RadioStack window > 1),
+        #then a robot that does not answer holds up one slot instead of the whole poll
+        self.window = window
+        self.busy = set()
+        self.last = {}
+        self.turn = 0
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.running = False
+        self.paused = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._poll_task,daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def pause(self):
+        #Keeps the radio free, e.g. while a scenario uploads
+        self.paused.set()
+
+    def resume(self):
+        self.paused.clear()
+
+    def _due(self):
+        #Round-robin over the fleet so one robot's backlog cannot starve the rest, called with the lock held
+        now = time.monotonic()
+        serials = [serial for serial in self.fleet.serials() if serial not in self.busy]
+        for i in range(len(serials)):
+            serial = serials[(self.turn + i) % len(serials)]
+            for field,(packet_type,interval) in self.fields.items():
+                if now - self.last.get((serial,field),0) >= interval:
+                    self.turn = (self.turn + i + 1) % len(serials)
+                    self.last[(serial,field)] = now
+                    self.busy.add(serial)
+                    return serial,field,packet_type
+        return None
+
+    def _poll_task(self):
+        while self.running:
+            with self.cond:
+                #Nothing to ask while the radio is unplugged, the cache just ages
+                due = None
+                if not self.paused.is_set() and len(self.busy) < self.window and self.htt.radio.connected:
+                    due = self._due()
+                if due is None:
+                    self.cond.wait(0.05)
+                    continue
+            serial,field,packet_type = due
+            try:
+                self.htt.request_async(lambda value,error,serial=serial,field=field: self._answered(serial,field,value,error),
+                                       packet_type,serial=serial)
+            except Exception as e:
+                self._answered(serial,field,None,e)
+
+    def _answered(self,serial,field,value,error):
+        if error is None:
+            self.cache.update(serial,field,value)
+        elif isinstance(error,RadioTimeout):
+            print(f'Telemetry {field} for {serial}: {error}')
+        else:
+            print(f'Telemetry {field} for {serial} failed: {error}')
+        with self.cond:
+            self.busy.discard(serial)
+            self.cond.notify_all()
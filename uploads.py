@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def scenario_hash(packets):
+    digest = hashlib.sha1()
+    for packet in packets:
+        digest.update(bytes(packet))
+    return digest.hexdigest()[:16]
+
+
+class UploadSession:
+    #Per-packet ack state of one scenario going to one robot, saved after every change
+    def __init__(self,store,serial,scenario,total,acked=(),attempts=0,started=None,updated=None,done=False):
+        self.store = store
+        self.serial = serial
+        self.scenario = scenario
+        self.total = total
+        self.acked = set(acked)
+        self.attempts = attempts
+        self.started = started or time.time()
+        self.updated = updated or time.time()
+        self.done = done
+
+    def missing(self):
+        return [idx for idx in range(self.total) if idx not in self.acked]
+
+    def ack(self,indices):
+        self.acked |= set(indices)
+        self.updated = time.time()
+        self.store.save(self)
+
+    def unack(self,indices):
+        #The robot asked again for packets it had acked, it lost them
+        self.acked -= set(indices)
+        self.updated = time.time()
+        self.store.save(self)
+
+    def finish(self):
+        self.done = len(self.acked) == self.total
+        self.updated = time.time()
+        self.store.save(self)
+
+    def progress(self):
+        return {'serial':self.serial,
+                'scenario':self.scenario,
+                'acked':len(self.acked),
+                'total':self.total,
+                'percent':round(100*len(self.acked)/self.total,1) if self.total else 100.0,
+                'next':min(self.missing(),default=None),
+                'attempts':self.attempts,
+                'started':self.started,
+                'updated':self.updated,
+                'done':self.done,
+                }
+
+    def to_dict(self):
+        return {'serial':self.serial,
+                'scenario':self.scenario,
+                'total':self.total,
+                'acked':sorted(self.acked),
+                'attempts':self.attempts,
+                'started':self.started,
+                'updated':self.updated,
+                'done':self.done,
+                }
+
+
+class UploadStore:
+    def __init__(self,directory='uploads'):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def _path(self,serial,scenario):
+        return os.path.join(self.directory,f'{serial}_{scenario}.json')
+
+    def open(self,serial,packets):
+        #Returns the saved session for this robot and scenario, or a fresh one
+        scenario = scenario_hash(packets)
+        with self.lock:
+            session = self.sessions.get((serial,scenario))
+            if session is None:
+                try:
+                    with open(self._path(serial,scenario)) as f:
+                        saved = json.load(f)
+                    saved.pop('serial',None)
+                    saved.pop('scenario',None)
+                    session = UploadSession(self,serial,scenario,**saved)
+                except (OSError,ValueError,TypeError):
+                    session = UploadSession(self,serial,scenario,len(packets))
+                self.sessions[(serial,scenario)] = session
+            if session.done:
+                #A finished scenario sent again is a new upload, not a resume
+                session.acked = set()
+                session.attempts = 0
+                session.started = time.time()
+            session.attempts += 1
+            session.done = False
+        self.save(session)
+        return session
+
+    def save(self,session):
+        with self.lock:
+            os.makedirs(self.directory,exist_ok=True)
+            path = self._path(session.serial,session.scenario)
+            with open(path+'.tmp','w') as f:
+                json.dump(session.to_dict(),f)
+            os.replace(path+'.tmp',path)
+
+    def discard(self,serial,scenario):
+        with self.lock:
+            self.sessions.pop((serial,scenario),None)
+            try:
+                os.remove(self._path(serial,scenario))
+            except OSError:
+                pass
+
+    def progress(self,serial=None):
+        #Every known session, newest first, optionally for one robot
+        with self.lock:
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if not name.endswith('.json'):
+                        continue
+                    serial_,scenario = name[:-5].split('_',1)
+                    key = (int(serial_),scenario)
+                    if key in self.sessions:
+                        continue
+                    try:
+                        with open(os.path.join(self.directory,name)) as f:
+                            saved = json.load(f)
+                    except (OSError,ValueError):
+                        continue
+                    saved.pop('serial',None)
+                    saved.pop('scenario',None)
+                    self.sessions[key] = UploadSession(self,*key,**saved)
+            sessions = [s for s in self.sessions.values() if serial is None or s.serial == serial]
+        return sorted((s.progress() for s in sessions),key=lambda p: -p['updated'])
@@ -0,0 +1,160 @@
+import argparse
+import random
+import time
+
+from protocol import USB
+from ptyradio import PtyRadio
+
+
+TYPES = {value:name for name,value in USB.types.items()}
+#paylen of the one-packet upload_scen request, counting the type byte
+UPLOAD_PAYLEN = 1 + USB.requests['upload_scen'].size
+
+
+def frame(codec,*values):
+    #Response frames start with the USB header byte and the payload length
+    packet = bytearray(codec.pack(*values))
+    packet[0] = USB.header
+    packet[1] = codec.size - 4
+    return bytes(packet)
+
+
+class EmulatedRobot:
+    #Answers HTT packets for one serial, position follows the last joystick vector
+    speed = 0.02  #metres per second per joystick step
+
+    def __init__(self,serial,client_id,origin=(362624.9,4071544.9),rng=None):
+        rng = rng or random.Random()
+        self.serial = serial
+        self.client_id = client_id
+        self.state = 2
+        self.errorbits = 0
+        self.x = origin[0] + rng.uniform(-50,50)
+        self.y = origin[1] + rng.uniform(-50,50)
+        self.joy = (0,0,0,0)
+        self.moved_at = time.monotonic()
+        self.bvolt = [2520,2515]
+        self.targets = 0
+        self.scenarios = {}
+        self.paths = 0
+        self.counts = {}
+
+    @property
+    def key(self):
+        return ((self.serial >> 0) & 0xF,(self.serial >> 4) & 0xF)
+
+    def _move(self):
+        now = time.monotonic()
+        dt,self.moved_at = now - self.moved_at,now
+        jx,jy = self.joy[0],self.joy[1]
+        self.x += jx*self.speed*dt
+        self.y += jy*self.speed*dt
+        return (jx*jx + jy*jy) ** 0.5 * self.speed
+
+    def handle(self,packet):
+        kind = TYPES.get(packet[4],packet[4])
+        self.counts[kind] = self.counts.get(kind,0) + 1
+        if kind == 'gps':
+            speed = self._move()
+            return frame(USB.responses['gps'],0,self.serial,int(self.x*10),int(self.y*10),
+                         0x31,0x35,0x53,0x00,12,3,0,min(255,int(speed*10)))
+        if kind == 'hit':
+            return frame(USB.responses['hit'],0,self.serial,1,3,5,2,0,0)
+        if kind == 'bat1':
+            return frame(USB.responses['bat1'],0,self.serial,*self.bvolt,80,81,82,120,118,5)
+        if kind == 'get_scen_info':
+            return frame(USB.responses['get_scen_info'],0,self.serial,packet[5],self.paths)
+        if kind == 'put_scen_info':
+            return frame(USB.responses['put_scen_info'],0,self.serial,0,packet[5])
+        if kind == 'upload_scen':
+            return self._upload(packet)
+        if kind == 'joy':
+            #Stick values go out offset by 100 so they fit a byte
+            self._move()
+            self.joy = tuple(value - 100 for value in packet[6:9]) + (packet[9],)
+        elif kind == 'select_target':
+            self.targets = packet[6]
+        #Commands and drives answer with the robot's status
+        return frame(USB.responses['system'],0,self.serial,self.client_id,self.state,self.errorbits)
+
+    def _upload(self,packet):
+        header = USB.requests['scen_header'].decode(packet)
+        total,index = header['total'],header['index']
+        stored = self.scenarios.setdefault(total,set())
+        stored.add(index)
+        wanted = next((i for i in range(total) if i not in stored),total)
+        if wanted == total:
+            self.scenarios.pop(total)
+            self.paths += 1
+        return frame(USB.responses['upload_scen'],USB.header,0,self.serial,index,wanted)
+
+
+class UsbRadioEmulator(PtyRadio):
+    #Pseudo-terminal that behaves like the HTT USB radio with robots on the air behind it
+    def __init__(self,robots=8,serials=None,latency=0.02,jitter=0.0,loss=0.0,seed=None):
+        super().__init__(latency,jitter,loss,seed)
+        serials = list(serials) if serials else [1201 + i for i in range(robots)]
+        self.robots = {}
+        for i,serial in enumerate(serials):
+            robot = EmulatedRobot(serial,i+1,rng=self.rng)
+            if robot.key in self.robots:
+                raise ValueError(f'Serial {serial} shares its radio address with {self.robots[robot.key].serial}')
+            self.robots[robot.key] = robot
+
+    def frames(self,buf):
+        #Host packets are 4 + paylen bytes, except scenario packets whose paylen leaves out one byte.
+        #The short upload_scen request from PacketBuilder.get is the one type 9 packet with the full paylen
+        upload,short = USB.types['upload_scen'],UPLOAD_PAYLEN
+        while len(buf) >= 5:
+            if buf[0] != USB.header:
+                idx = buf.find(bytes([USB.header]),1)
+                del buf[:idx if idx > 0 else len(buf)]
+                self.counters['garbage'] += 1
+                continue
+            length = 4 + buf[1] + (1 if buf[4] == upload and buf[1] != short else 0)
+            if len(buf) < length:
+                return
+            packet = bytes(buf[:length])
+            del buf[:length]
+            yield packet
+
+    def receive(self,packet):
+        robot = self.robots.get((packet[2],packet[3]))
+        if robot is None:
+            self.counters['unknown'] += 1
+            return
+        if self.lost():
+            return
+        response = robot.handle(packet)
+        #A lost answer means the robot acted on the packet but the host never hears back
+        if response is not None and not self.lost():
+            self.send(response)
+
+    def stats(self):
+        return {'port':self.port,
+                **self.counters,
+                'robots':{robot.serial:dict(robot.counts) for robot in self.robots.values()},
+                }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulated HTT USB radio with robots behind it, on a pseudo-terminal')
+    parser.add_argument('--robots',type=int,default=8)
+    parser.add_argument('--serials',type=int,nargs='*',help='robot serials, default 1201 upwards')
+    parser.add_argument('--latency',type=float,default=0.02,help='seconds until a robot answers')
+    parser.add_argument('--jitter',type=float,default=0.0,help='up to this many more seconds')
+    parser.add_argument('--loss',type=float,default=0.0,help='chance a packet gets no answer')
+    parser.add_argument('--seed',type=int)
+    args = parser.parse_args()
+    emulator = UsbRadioEmulator(args.robots,args.serials,args.latency,args.jitter,args.loss,args.seed)
+    print(f'Emulated radio on {emulator.start()}, robots {[r.serial for r in emulator.robots.values()]}')
+    try:
+        while True:
+            time.sleep(10)
+            print(emulator.stats())
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()